@@ -0,0 +1,82 @@
+import hashlib
+import io
+import os
+import time
+
+import pygame
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+IMAGES_DIR = os.path.join(ROOT, 'images')
+CACHE_DIR = os.path.join(ROOT, '.cache', 'atlas')
+ATLAS_VERSION = 1
+PLACEHOLDER_COLOR = (150, 150, 150)
+
+class PieceAtlas:
+    """All piece images scaled to one square size and packed side by side
+    in a single surface. The packed image is cached as a PNG whose name
+    holds the square size and a hash of the source files, so a launch with
+    unchanged images and size only decodes that one file. Images that fail
+    to load are drawn as grey squares and the atlas is not cached."""
+
+    def __init__(self, files, size, images_dir=IMAGES_DIR, cache_dir=CACHE_DIR):
+        start = time.perf_counter()
+        self.codes = list(files)
+        self.size = size
+        self.missing = []
+        self.cached = False
+        sources = {}
+        digest = hashlib.sha1(repr((ATLAS_VERSION, size, self.codes)).encode())
+        for code in self.codes:
+            path = os.path.join(images_dir, files[code])
+            try:
+                with open(path, 'rb') as f:
+                    sources[code] = f.read()
+            except OSError:
+                sources[code] = None
+            digest.update(hashlib.sha1(sources[code] or b'').digest())
+        path = os.path.join(cache_dir, 'pieces-%d-%s.png' % (size, digest.hexdigest()[:12]))
+        try:
+            self.surface = pygame.image.load(path).convert_alpha()
+            self.cached = True
+        except (pygame.error, OSError):
+            self.surface = self.pack(files, sources)
+            if not self.missing:
+                self.save(path)
+        self.images = {code: self.surface.subsurface((i * size, 0, size, size))
+                       for i, code in enumerate(self.codes)}
+        self.load_seconds = time.perf_counter() - start
+
+    def pack(self, files, sources):
+        size = self.size
+        surface = pygame.Surface((size * len(self.codes), size), pygame.SRCALPHA)
+        for i, code in enumerate(self.codes):
+            rect = (i * size, 0, size, size)
+            data = sources[code]
+            try:
+                if data is None:
+                    raise FileNotFoundError(files[code])
+                img = pygame.image.load(io.BytesIO(data), files[code]).convert_alpha()
+            except (pygame.error, OSError) as e:
+                self.missing.append(files[code])
+                print('cannot load piece image %s: %s' % (files[code], e))
+                surface.fill(PLACEHOLDER_COLOR, rect)
+                continue
+            surface.blit(pygame.transform.smoothscale(img, (size, size)), rect)
+        return surface
+
+    def save(self, path):
+        directory, name = os.path.split(path)
+        prefix = 'pieces-%d-' % self.size
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for stale in os.listdir(directory):
+                if stale.startswith(prefix) and stale != name:
+                    os.remove(os.path.join(directory, stale))
+            pygame.image.save(self.surface, path)
+        except (pygame.error, OSError):
+            pass
+
+    def report(self):
+        return 'pieces: %d at %dpx in %.1f ms (%s)' % (
+            len(self.images), self.size, self.load_seconds * 1000,
+            'cached atlas' if self.cached else 'packed from %d files' % (len(self.codes) - len(self.missing)))
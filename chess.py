@@ -1,11 +1,24 @@
+import os
 import pygame
 import sys
-import copy
+import time
+from collections import OrderedDict
+
+from engine import (AIWorker, GameState, MoveCache, decode_move, find_king, in_bounds, is_in_check, is_white,
+                    make_move)
+from assets import PieceAtlas
+from engine.book import load_book
+from engine.gamelog import GameLogWriter
+from engine.profiling import GameProfiler, format_hot_functions, load_hot_functions, profile_path
+from sounds import SoundBank
 
 SQ_SIZE = 80
 BOARD_SIZE = SQ_SIZE * 8
 FPS = 60
 ANIMATION_SPEED = 10
+FPS_LABEL_INTERVAL = 0.5
+LABEL_CACHE_SIZE = 64
+AI_TIME_LIMITS = {"Easy": 0.1, "Medium": 0.5, "Hard": 2.0}
 
 WHITE = (240, 217, 181)
 BROWN = (181, 136, 99)
@@ -19,371 +32,20 @@ PIECE_TO_IMG = {
     'p': 'bp.png', 'r': 'br.png', 'n': 'bn.png', 'b': 'bb.png', 'q': 'bq.png', 'k': 'bk.png'
 }
 
-STARTING_BOARD = [
-    ['r','n','b','q','k','b','n','r'],
-    ['p','p','p','p','p','p','p','p'],
-    ['.','.','.','.','.','.','.','.'],
-    ['.','.','.','.','.','.','.','.'],
-    ['.','.','.','.','.','.','.','.'],
-    ['.','.','.','.','.','.','.','.'],
-    ['P','P','P','P','P','P','P','P'],
-    ['R','N','B','Q','K','B','N','R']
-]
-
-class GameState:
-    def __init__(self):
-        self.board = [row[:] for row in STARTING_BOARD]
-        self.white_turn = True
-        self.en_passant_target = None
-        self.castling_rights = {'K': True, 'Q': True, 'k': True, 'q': True}
-        self.king_moved = {'white': False, 'black': False}
-        self.rook_moved = {'white': {'kingside': False, 'queenside': False},
-                          'black': {'kingside': False, 'queenside': False}}
-        self.move_history = []
-        self.last_move = None
-
-    def copy(self):
-        new_state = GameState()
-        new_state.board = [row[:] for row in self.board]
-        new_state.white_turn = self.white_turn
-        new_state.en_passant_target = self.en_passant_target
-        new_state.castling_rights = self.castling_rights.copy()
-        new_state.king_moved = self.king_moved.copy()
-        new_state.rook_moved = copy.deepcopy(self.rook_moved)
-        new_state.last_move = self.last_move
-        return new_state
-
-def in_bounds(r, c):
-    return 0 <= r < 8 and 0 <= c < 8
-
-def is_white(p):
-    return p.isupper()
-
-def is_black(p):
-    return p.islower()
-
-def find_king(board, white):
-    target = 'K' if white else 'k'
-    for r in range(8):
-        for c in range(8):
-            if board[r][c] == target:
-                return (r, c)
-    return None
-
-def is_attacked(board, r, c, by_white):
-    pawn_dir = 1 if by_white else -1
-    pawn = 'P' if by_white else 'p'
-    for dc in [-1, 1]:
-        pr, pc = r + pawn_dir, c + dc
-        if in_bounds(pr, pc) and board[pr][pc] == pawn:
-            return True
-    
-    knight = 'N' if by_white else 'n'
-    for dr, dc in [(2,1),(2,-1),(-2,1),(-2,-1),(1,2),(1,-2),(-1,2),(-1,-2)]:
-        nr, nc = r + dr, c + dc
-        if in_bounds(nr, nc) and board[nr][nc] == knight:
-            return True
-    
-    king = 'K' if by_white else 'k'
-    for dr in [-1, 0, 1]:
-        for dc in [-1, 0, 1]:
-            if dr == 0 and dc == 0:
-                continue
-            kr, kc = r + dr, c + dc
-            if in_bounds(kr, kc) and board[kr][kc] == king:
-                return True
-    
-    rook_queen = ['R', 'Q'] if by_white else ['r', 'q']
-    bishop_queen = ['B', 'Q'] if by_white else ['b', 'q']
-    
-    for dr, dc in [(1,0),(-1,0),(0,1),(0,-1)]:
-        nr, nc = r + dr, c + dc
-        while in_bounds(nr, nc):
-            if board[nr][nc] != '.':
-                if board[nr][nc] in rook_queen:
-                    return True
-                break
-            nr += dr
-            nc += dc
-    
-    for dr, dc in [(1,1),(1,-1),(-1,1),(-1,-1)]:
-        nr, nc = r + dr, c + dc
-        while in_bounds(nr, nc):
-            if board[nr][nc] != '.':
-                if board[nr][nc] in bishop_queen:
-                    return True
-                break
-            nr += dr
-            nc += dc
-    
-    return False
-
-def is_in_check(board, white):
-    king_pos = find_king(board, white)
-    if not king_pos:
-        return False
-    return is_attacked(board, king_pos[0], king_pos[1], not white)
-
-def get_pseudo_legal_moves(state, r, c):
-    board = state.board
-    piece = board[r][c]
-    if piece == '.':
-        return []
-    
-    moves = []
-    color_white = piece.isupper()
-    p = piece.lower()
-    
-    if p == 'p':
-        direction = -1 if color_white else 1
-        start_row = 6 if color_white else 1
-        
-        if in_bounds(r + direction, c) and board[r + direction][c] == '.':
-            moves.append((r + direction, c))
-            if r == start_row and board[r + 2*direction][c] == '.':
-                moves.append((r + 2*direction, c))
-        
-        for dc in [-1, 1]:
-            nr, nc = r + direction, c + dc
-            if in_bounds(nr, nc):
-                target = board[nr][nc]
-                if target != '.' and (target.isupper() != color_white):
-                    moves.append((nr, nc))
-        
-        if state.en_passant_target:
-            ep_r, ep_c = state.en_passant_target
-            if r + direction == ep_r and abs(c - ep_c) == 1:
-                moves.append((ep_r, ep_c))
-        
-        return moves
-    
-    if p == 'n':
-        for dr, dc in [(2,1),(2,-1),(-2,1),(-2,-1),(1,2),(1,-2),(-1,2),(-1,-2)]:
-            nr, nc = r + dr, c + dc
-            if in_bounds(nr, nc):
-                target = board[nr][nc]
-                if target == '.' or target.isupper() != color_white:
-                    moves.append((nr, nc))
-        return moves
-    
-    if p in ('b', 'r', 'q'):
-        directions = []
-        if p in ('r', 'q'):
-            directions += [(1,0),(-1,0),(0,1),(0,-1)]
-        if p in ('b', 'q'):
-            directions += [(1,1),(1,-1),(-1,1),(-1,-1)]
-        
-        for dr, dc in directions:
-            nr, nc = r + dr, c + dc
-            while in_bounds(nr, nc):
-                target = board[nr][nc]
-                if target == '.':
-                    moves.append((nr, nc))
-                else:
-                    if target.isupper() != color_white:
-                        moves.append((nr, nc))
-                    break
-                nr += dr
-                nc += dc
-        
-        return moves
-    
-    if p == 'k':
-        for dr in [-1, 0, 1]:
-            for dc in [-1, 0, 1]:
-                if dr == 0 and dc == 0:
-                    continue
-                nr, nc = r + dr, c + dc
-                if in_bounds(nr, nc):
-                    target = board[nr][nc]
-                    if target == '.' or target.isupper() != color_white:
-                        moves.append((nr, nc))
-        
-        if not is_in_check(board, color_white):
-            row = 7 if color_white else 0
-            if r == row and c == 4:
-                if state.castling_rights['K' if color_white else 'k']:
-                    if (board[row][5] == '.' and board[row][6] == '.' and
-                        not is_attacked(board, row, 5, not color_white) and
-                        not is_attacked(board, row, 6, not color_white)):
-                        moves.append((row, 6))
-                
-                if state.castling_rights['Q' if color_white else 'q']:
-                    if (board[row][3] == '.' and board[row][2] == '.' and board[row][1] == '.' and
-                        not is_attacked(board, row, 3, not color_white) and
-                        not is_attacked(board, row, 2, not color_white)):
-                        moves.append((row, 2))
-        
-        return moves
-    
-    return moves
-
-def get_legal_moves(state, r, c):
-    pseudo_moves = get_pseudo_legal_moves(state, r, c)
-    legal_moves = []
-    
-    for move in pseudo_moves:
-        new_state = make_move(state, (r, c), move, validate=False)
-        if not is_in_check(new_state.board, state.white_turn):
-            legal_moves.append(move)
-    
-    return legal_moves
-
-def make_move(state, from_pos, to_pos, validate=True):
-    r1, c1 = from_pos
-    r2, c2 = to_pos
-    
-    new_state = state.copy()
-    board = new_state.board
-    piece = board[r1][c1]
-    
-    is_en_passant = False
-    if piece.lower() == 'p' and state.en_passant_target == (r2, c2):
-        is_en_passant = True
-        capture_row = r1
-        board[capture_row][c2] = '.'
-    
-    is_castling = False
-    if piece.lower() == 'k' and abs(c2 - c1) == 2:
-        is_castling = True
-        if c2 == 6:
-            board[r1][5] = board[r1][7]
-            board[r1][7] = '.'
-        else:
-            board[r1][3] = board[r1][0]
-            board[r1][0] = '.'
-    
-    board[r2][c2] = piece
-    board[r1][c1] = '.'
-    
-    if piece == 'P' and r2 == 0:
-        board[r2][c2] = 'Q'
-    elif piece == 'p' and r2 == 7:
-        board[r2][c2] = 'q'
-    
-    new_state.en_passant_target = None
-    if piece.lower() == 'p' and abs(r2 - r1) == 2:
-        new_state.en_passant_target = ((r1 + r2) // 2, c1)
-    
-    if piece == 'K':
-        new_state.castling_rights['K'] = False
-        new_state.castling_rights['Q'] = False
-    elif piece == 'k':
-        new_state.castling_rights['k'] = False
-        new_state.castling_rights['q'] = False
-    elif piece == 'R':
-        if r1 == 7 and c1 == 7:
-            new_state.castling_rights['K'] = False
-        elif r1 == 7 and c1 == 0:
-            new_state.castling_rights['Q'] = False
-    elif piece == 'r':
-        if r1 == 0 and c1 == 7:
-            new_state.castling_rights['k'] = False
-        elif r1 == 0 and c1 == 0:
-            new_state.castling_rights['q'] = False
-    
-    new_state.last_move = (from_pos, to_pos)
-    new_state.white_turn = not state.white_turn
-    
-    return new_state
-
-def all_legal_moves(state):
-    moves = []
-    for r in range(8):
-        for c in range(8):
-            piece = state.board[r][c]
-            if piece != '.' and is_white(piece) == state.white_turn:
-                for to_pos in get_legal_moves(state, r, c):
-                    moves.append(((r, c), to_pos))
-    return moves
-
-def is_checkmate(state):
-    if not is_in_check(state.board, state.white_turn):
-        return False
-    return len(all_legal_moves(state)) == 0
-
-def is_stalemate(state):
-    if is_in_check(state.board, state.white_turn):
-        return False
-    return len(all_legal_moves(state)) == 0
-
-def eval_board(state):
-    piece_values = {'p': 1, 'n': 3, 'b': 3, 'r': 5, 'q': 9, 'k': 0}
-    
-    if is_checkmate(state):
-        return 10000 if not state.white_turn else -10000
-    if is_stalemate(state):
-        return 0
-    
-    val = 0
-    for row in state.board:
-        for p in row:
-            if p == '.':
-                continue
-            score = piece_values[p.lower()]
-            val += score if p.isupper() else -score
-    
-    return val
-
-def minimax(state, depth, alpha, beta, maximizing):
-    if depth == 0 or is_checkmate(state) or is_stalemate(state):
-        return eval_board(state), None
-    
-    moves = all_legal_moves(state)
-    if not moves:
-        return eval_board(state), None
-    
-    best_move = None
-    
-    if maximizing:
-        max_eval = -99999
-        for from_pos, to_pos in moves:
-            new_state = make_move(state, from_pos, to_pos)
-            eval_score, _ = minimax(new_state, depth - 1, alpha, beta, False)
-            if eval_score > max_eval:
-                max_eval = eval_score
-                best_move = (from_pos, to_pos)
-            alpha = max(alpha, eval_score)
-            if beta <= alpha:
-                break
-        return max_eval, best_move
-    else:
-        min_eval = 99999
-        for from_pos, to_pos in moves:
-            new_state = make_move(state, from_pos, to_pos)
-            eval_score, _ = minimax(new_state, depth - 1, alpha, beta, True)
-            if eval_score < min_eval:
-                min_eval = eval_score
-                best_move = (from_pos, to_pos)
-            beta = min(beta, eval_score)
-            if beta <= alpha:
-                break
-        return min_eval, best_move
-
-def load_images():
-    imgs = {}
-    for code, filename in PIECE_TO_IMG.items():
-        try:
-            img = pygame.image.load('images/' + filename).convert_alpha()
-            imgs[code] = pygame.transform.smoothscale(img, (SQ_SIZE, SQ_SIZE))
-        except:
-            surf = pygame.Surface((SQ_SIZE, SQ_SIZE))
-            surf.fill((150, 150, 150))
-            imgs[code] = surf
-    return imgs
-
-def create_sound(freq, duration=100):
-    try:
-        sample_rate = 22050
-        frames = int(duration * sample_rate / 1000)
-        arr = []
-        for i in range(frames):
-            value = int(32767 * 0.3 * pygame.math.Vector2(1, 0).rotate(360 * freq * i / sample_rate).x)
-            arr.append([value, value])
-        sound = pygame.sndarray.make_sound(pygame.array.array('h', [item for sublist in arr for item in sublist]))
-        return sound
-    except:
-        return None
+def move_sound(state, from_pos, to_pos):
+    piece = state.piece_at(*from_pos)
+    if piece in 'Kk' and abs(to_pos[1] - from_pos[1]) == 2:
+        return 'castle'
+    if state.piece_at(*to_pos) != '.' or piece in 'Pp' and from_pos[1] != to_pos[1]:
+        return 'capture'
+    return 'move'
+
+def result_sound(state, game_over, sound):
+    if game_over:
+        return 'game_over'
+    if is_in_check(state, state.white_turn):
+        return 'check'
+    return sound
 
 def draw_board(screen):
     for r in range(8):
@@ -391,20 +53,142 @@ def draw_board(screen):
             color = WHITE if (r + c) % 2 == 0 else BROWN
             pygame.draw.rect(screen, color, (c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-def draw_pieces(screen, board, imgs, animating_piece=None):
-    for r in range(8):
-        for c in range(8):
-            if animating_piece and animating_piece['from'] == (r, c):
-                continue
-            piece = board[r][c]
-            if piece != '.' and piece in imgs:
-                screen.blit(imgs[piece], (c*SQ_SIZE, r*SQ_SIZE))
-
-def highlight_squares(screen, squares, color=HIGHLIGHT):
-    surf = pygame.Surface((SQ_SIZE, SQ_SIZE), pygame.SRCALPHA)
-    surf.fill(color)
-    for r, c in squares:
-        screen.blit(surf, (c*SQ_SIZE, r*SQ_SIZE))
+def square_rect(sq):
+    r, c = divmod(sq, 8)
+    return pygame.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+def squares_under(rect):
+    rows = range(max(0, rect.top // SQ_SIZE), min(7, (rect.bottom - 1) // SQ_SIZE) + 1)
+    cols = range(max(0, rect.left // SQ_SIZE), min(7, (rect.right - 1) // SQ_SIZE) + 1)
+    return {r * 8 + c for r in rows for c in cols}
+
+class Renderer:
+    """Draws the game with dirty rectangles.
+
+    The empty board is drawn once into a cached surface. Highlight overlays
+    and text labels are built once and reused. Each frame only the squares
+    whose contents changed are redrawn, together with the squares under the
+    moving piece and under any label that changed, and only those rectangles
+    are sent to the display.
+    """
+
+    def __init__(self, screen, imgs):
+        self.screen = screen
+        self.imgs = imgs
+        self.board = pygame.Surface((BOARD_SIZE, BOARD_SIZE))
+        draw_board(self.board)
+        self.overlays = {}
+        self.label_cache = OrderedDict()
+        self.drawn = [None] * 64
+        self.shown_labels = []
+        self.sprite_rect = None
+        self.check_key = None
+        self.checked_king = None
+        self.first_frame = True
+
+    def overlay(self, color):
+        surf = self.overlays.get(color)
+        if surf is None:
+            surf = pygame.Surface((SQ_SIZE, SQ_SIZE), pygame.SRCALPHA)
+            surf.fill(color)
+            self.overlays[color] = surf
+        return surf
+
+    def label(self, font, text, alpha=180, padding=(20, 10)):
+        key = (id(font), text, alpha, padding)
+        label = self.label_cache.get(key)
+        if label is not None:
+            self.label_cache.move_to_end(key)
+        else:
+            text_surf = font.render(text, True, (255, 255, 255))
+            bg = pygame.Surface((text_surf.get_width() + padding[0], text_surf.get_height() + padding[1]))
+            bg.fill((0, 0, 0))
+            bg.set_alpha(alpha)
+            label = self.label_cache[key] = (bg, text_surf, (padding[0] // 2, padding[1] // 2))
+            # The stats overlay changes after every search, so keep only
+            # the most recently used labels.
+            if len(self.label_cache) > LABEL_CACHE_SIZE:
+                self.label_cache.popitem(last=False)
+        return label
+
+    def king_in_check(self, state):
+        if state.zobrist != self.check_key:
+            self.check_key = state.zobrist
+            in_check = is_in_check(state, state.white_turn)
+            self.checked_king = find_king(state, state.white_turn) if in_check else None
+        return self.checked_king
+
+    def draw(self, state, selected, valid_moves, animation, labels):
+        colors = {}
+        def highlight(squares, color):
+            for r, c in squares:
+                colors.setdefault(r * 8 + c, []).append(color)
+        if state.last_move and not animation:
+            highlight(decode_move(state.last_move), MOVE_HIGHLIGHT)
+        if selected and not animation:
+            highlight([selected] + valid_moves, HIGHLIGHT)
+        king = self.king_in_check(state)
+        if king:
+            highlight([king], CHECK_HIGHLIGHT)
+
+        hidden = None
+        sprite_rect = None
+        if animation:
+            piece, (fr, fc), (tr, tc), progress = animation
+            hidden = tr * 8 + tc
+            sprite_rect = pygame.Rect(fc * SQ_SIZE + (tc - fc) * progress, fr * SQ_SIZE + (tr - fr) * progress,
+                                      SQ_SIZE, SQ_SIZE)
+
+        squares = state.squares
+        wanted = [((squares[sq] if sq != hidden else '.'), tuple(colors.get(sq, ()))) for sq in range(64)]
+        if self.first_frame:
+            dirty = set(range(64))
+        else:
+            dirty = {sq for sq in range(64) if wanted[sq] != self.drawn[sq]}
+        for rect in (self.sprite_rect, sprite_rect):
+            if rect:
+                dirty |= squares_under(rect)
+
+        placed = [(bg, text, offset, bg.get_rect(topleft=pos)) for (bg, text, offset), pos in labels]
+        shown = [(id(bg), rect) for bg, _, _, rect in placed]
+        for key in shown + self.shown_labels:
+            if (key in shown) != (key in self.shown_labels):
+                dirty |= squares_under(key[1])
+        for _, _, _, rect in placed:
+            under = squares_under(rect)
+            if under & dirty:
+                dirty |= under
+
+        screen = self.screen
+        rects = []
+        for sq in dirty:
+            rect = square_rect(sq)
+            screen.blit(self.board, rect, rect)
+            piece, square_colors = wanted[sq]
+            for color in square_colors:
+                screen.blit(self.overlay(color), rect)
+            if piece != '.' and piece in self.imgs:
+                screen.blit(self.imgs[piece], rect)
+            self.drawn[sq] = wanted[sq]
+            rects.append(rect)
+        if sprite_rect:
+            screen.blit(self.imgs[animation[0]], sprite_rect)
+        for bg, text, offset, rect in placed:
+            if squares_under(rect) & dirty:
+                screen.blit(bg, rect)
+                screen.blit(text, (rect.x + offset[0], rect.y + offset[1]))
+                rects.append(rect)
+
+        self.sprite_rect = sprite_rect
+        self.shown_labels = shown
+        if self.first_frame:
+            self.first_frame = False
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
+
+    def invalidate(self):
+        self.first_frame = True
 
 def coords_to_square(pos):
     return pos[1] // SQ_SIZE, pos[0] // SQ_SIZE
@@ -459,17 +243,36 @@ def main():
     small_font = pygame.font.SysFont(None, 24)
 
     mode, difficulty, side = menu(screen, font)
-    ai_depth = {"Easy": 1, "Medium": 2, "Hard": 3}[difficulty]
-    
-    move_sound = create_sound(440, 50)
-    capture_sound = create_sound(330, 80)
+    started_at = time.perf_counter()
+    profile_dir = os.environ.get('CHESS_PROFILE')
+    game_id = time.strftime('%Y%m%d-%H%M%S')
+    profiler = None
+    if profile_dir:
+        profiler = GameProfiler(profile_path(profile_dir, game_id, 'ui'))
+        profiler.enable()
+    ai_time = AI_TIME_LIMITS[difficulty]
+    
+    sounds = SoundBank()
+    print(sounds.report())
     
     state = GameState()
-    imgs = load_images()
+    move_cache = MoveCache()
+    game_log = GameLogWriter()
+    atlas = PieceAtlas(PIECE_TO_IMG, SQ_SIZE)
+    print(atlas.report())
     selected = None
     valid_moves = []
     user_is_white = (side == "White")
     vs_ai = (mode == "Player vs Computer")
+    search_profile = profile_path(profile_dir, game_id, 'search') if profile_dir else None
+    ai = AIWorker(profile=search_profile) if vs_ai else None
+    book = load_book() if vs_ai else None
+    computer = "Computer (%s)" % difficulty
+    record = game_log.new_game(state, {
+        "Event": "Casual game", "Site": "Enhanced Chess Game", "Date": time.strftime("%Y.%m.%d"),
+        "White": computer if vs_ai and not user_is_white else "Player",
+        "Black": computer if vs_ai and user_is_white else "Player",
+    })
     
     animating = False
     anim_piece = None
@@ -479,13 +282,17 @@ def main():
     
     game_over = False
     result_text = ""
+    outcome = ("*", "abandoned")
     
     fps_font = pygame.font.SysFont(None, 20)
+    renderer = Renderer(screen, atlas.images)
+    fps_label = renderer.label(fps_font, "FPS: 0")
+    fps_shown_at = time.perf_counter()
+    show_stats = False
     
     running = True
     while running:
         clock.tick(FPS)
-        current_fps = clock.get_fps()
         
         if animating:
             anim_progress += ANIMATION_SPEED
@@ -494,36 +301,64 @@ def main():
                 anim_piece = None
         
         if not game_over and vs_ai and state.white_turn != user_is_white and not animating:
-            _, move = minimax(state, ai_depth, -99999, 99999, state.white_turn)
+            move = None
+            if not ai.thinking:
+                move = book.choose(state, move_cache=move_cache) if book else None
+                if move:
+                    ai.stop_pondering()
+                else:
+                    ai.start(state, ai_time)
+            if not move:
+                move = ai.poll(state)
             if move:
-                from_pos, to_pos = move
+                from_pos, to_pos = decode_move(move)
                 
-                if state.board[to_pos[0]][to_pos[1]] != '.':
-                    if capture_sound:
-                        capture_sound.play()
-                else:
-                    if move_sound:
-                        move_sound.play()
+                sound = move_sound(state, from_pos, to_pos)
                 
                 animating = True
                 anim_from = from_pos
                 anim_to = to_pos
-                anim_piece = state.board[from_pos[0]][from_pos[1]]
+                anim_piece = state.piece_at(*from_pos)
                 anim_progress = 0
                 
                 state = make_move(state, from_pos, to_pos)
+                record.push(state.last_move)
                 
-                if is_checkmate(state):
+                if move_cache.is_checkmate(state):
                     game_over = True
                     result_text = "White wins!" if not state.white_turn else "Black wins!"
-                elif is_stalemate(state):
+                    outcome = ("1-0" if not state.white_turn else "0-1", "checkmate")
+                elif move_cache.is_stalemate(state):
                     game_over = True
                     result_text = "Stalemate!"
+                    outcome = ("1/2-1/2", "stalemate")
+                else:
+                    ai.ponder(state)
+                sounds.play(result_sound(state, game_over, sound))
         
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
             
+            if event.type == pygame.VIDEOEXPOSE:
+                renderer.invalidate()
+            
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_s:
+                show_stats = not show_stats
+            
+            # U or Backspace takes back a move; against the computer, back to the player's last move.
+            if event.type == pygame.KEYDOWN and event.key in (pygame.K_u, pygame.K_BACKSPACE) and not animating:
+                plies = 2 if vs_ai and state.white_turn == user_is_white else 1
+                if len(record) >= plies:
+                    if ai:
+                        ai.cancel()
+                    state = record.takeback(plies)
+                    selected = None
+                    valid_moves = []
+                    game_over = False
+                    result_text = ""
+                    outcome = ("*", "abandoned")
+            
             if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                 if game_over:
                     continue
@@ -536,94 +371,83 @@ def main():
                 if not in_bounds(r, c):
                     continue
                 
-                piece = state.board[r][c]
+                piece = state.piece_at(r, c)
                 
                 if piece != '.' and is_white(piece) == state.white_turn:
                     selected = (r, c)
-                    valid_moves = get_legal_moves(state, r, c)
+                    valid_moves = move_cache.legal_moves(state, r, c)
                 elif selected and (r, c) in valid_moves:
                     from_pos = selected
                     to_pos = (r, c)
                     
-                    if state.board[to_pos[0]][to_pos[1]] != '.':
-                        if capture_sound:
-                            capture_sound.play()
-                    else:
-                        if move_sound:
-                            move_sound.play()
+                    sound = move_sound(state, from_pos, to_pos)
                     
                     animating = True
                     anim_from = from_pos
                     anim_to = to_pos
-                    anim_piece = state.board[from_pos[0]][from_pos[1]]
+                    anim_piece = state.piece_at(*from_pos)
                     anim_progress = 0
                     
                     state = make_move(state, from_pos, to_pos)
+                    record.push(state.last_move)
                     selected = None
                     valid_moves = []
                     
-                    if is_checkmate(state):
+                    if move_cache.is_checkmate(state):
                         game_over = True
                         result_text = "White wins!" if not state.white_turn else "Black wins!"
-                    elif is_stalemate(state):
+                        outcome = ("1-0" if not state.white_turn else "0-1", "checkmate")
+                    elif move_cache.is_stalemate(state):
                         game_over = True
                         result_text = "Stalemate!"
+                        outcome = ("1/2-1/2", "stalemate")
+                    sounds.play(result_sound(state, game_over, sound))
                 else:
                     selected = None
                     valid_moves = []
         
-        draw_board(screen)
-        
-        if state.last_move and not animating:
-            highlight_squares(screen, [state.last_move[0], state.last_move[1]], MOVE_HIGHLIGHT)
-        
-        if selected and not animating:
-            highlight_squares(screen, [selected] + valid_moves)
-        
-        if is_in_check(state.board, state.white_turn):
-            king_pos = find_king(state.board, state.white_turn)
-            if king_pos:
-                highlight_squares(screen, [king_pos], CHECK_HIGHLIGHT)
-        
-        draw_pieces(screen, state.board, imgs, {'from': anim_from} if animating else None)
-        
-        if animating and anim_piece and anim_from and anim_to:
-            from_x, from_y = anim_from[1] * SQ_SIZE, anim_from[0] * SQ_SIZE
-            to_x, to_y = anim_to[1] * SQ_SIZE, anim_to[0] * SQ_SIZE
-            progress_ratio = anim_progress / SQ_SIZE
-            current_x = from_x + (to_x - from_x) * progress_ratio
-            current_y = from_y + (to_y - from_y) * progress_ratio
-            screen.blit(imgs[anim_piece], (current_x, current_y))
-        
+        if time.perf_counter() - fps_shown_at >= FPS_LABEL_INTERVAL:
+            fps_shown_at = time.perf_counter()
+            fps_label = renderer.label(fps_font, f"FPS: {int(clock.get_fps())}")
+
         status = "White" if state.white_turn else "Black"
-        if is_in_check(state.board, state.white_turn):
+        if renderer.king_in_check(state):
             status += " - CHECK!"
-        status_text = small_font.render(status, True, (255, 255, 255))
-        status_bg = pygame.Surface((status_text.get_width() + 20, status_text.get_height() + 10))
-        status_bg.fill((0, 0, 0))
-        status_bg.set_alpha(180)
-        screen.blit(status_bg, (10, 10))
-        screen.blit(status_text, (20, 15))
-        
-        fps_text = fps_font.render(f"FPS: {int(current_fps)}", True, (255, 255, 255))
-        fps_bg = pygame.Surface((fps_text.get_width() + 20, fps_text.get_height() + 10))
-        fps_bg.fill((0, 0, 0))
-        fps_bg.set_alpha(180)
-        screen.blit(fps_bg, (BOARD_SIZE - fps_bg.get_width() - 10, 10))
-        screen.blit(fps_text, (BOARD_SIZE - fps_bg.get_width(), 15))
-        
+        if ai and ai.thinking:
+            status += " - thinking" + "." * (int((time.perf_counter() - ai.started) * 3) % 4)
+        status_label = renderer.label(small_font, status)
+        labels = [(status_label, (10, 10)),
+                  (fps_label, (BOARD_SIZE - fps_label[0].get_width() - 10, 10))]
+        if show_stats and ai and ai.stats:
+            y = 14 + fps_label[0].get_height()
+            for line in ai.stats.summary():
+                stats_label = renderer.label(fps_font, line)
+                labels.append((stats_label, (BOARD_SIZE - stats_label[0].get_width() - 10, y)))
+                y += stats_label[0].get_height() + 4
         if game_over:
-            result_surface = font.render(result_text, True, (255, 255, 255))
-            bg = pygame.Surface((result_surface.get_width() + 40, result_surface.get_height() + 20))
-            bg.fill((0, 0, 0))
-            bg.set_alpha(200)
-            bg_x = BOARD_SIZE // 2 - bg.get_width() // 2
-            bg_y = BOARD_SIZE // 2 - bg.get_height() // 2
-            screen.blit(bg, (bg_x, bg_y))
-            screen.blit(result_surface, (bg_x + 20, bg_y + 10))
-        
-        pygame.display.flip()
-
+            result_label = renderer.label(font, result_text, alpha=200, padding=(40, 20))
+            labels.append((result_label, (BOARD_SIZE // 2 - result_label[0].get_width() // 2,
+                                          BOARD_SIZE // 2 - result_label[0].get_height() // 2)))
+
+        animation = (anim_piece, anim_from, anim_to, anim_progress) if animating else None
+        renderer.draw(state, selected, valid_moves, animation, labels)
+        if started_at is not None:
+            print('first frame: %.1f ms' % ((time.perf_counter() - started_at) * 1000))
+            started_at = None
+
+    record.finish(*outcome)
+    game_log.close()
+    if ai:
+        ai.close()
+    if book:
+        book.close()
+    if profiler:
+        profiler.disable()
+        print('profile written to', profiler.path)
+        print(format_hot_functions(profiler.save()))
+        if search_profile and os.path.exists(search_profile):
+            print('profile written to', search_profile)
+            print(format_hot_functions(load_hot_functions(search_profile)))
     pygame.quit()
     sys.exit()
 
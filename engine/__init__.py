@@ -0,0 +1,10 @@
+from .board import (
+    GameState, MoveCache, PIECES, SQUARES, START_FEN, STARTING_BOARD, all_legal_moves, compute_zobrist,
+    decode_move, encode_move, eval_board, find_king, generate_moves, get_legal_moves, get_pseudo_legal_moves,
+    in_bounds, is_attacked, is_black, is_checkmate, is_in_check, is_stalemate, is_white, make_move,
+    move_to_uci, parse_square, parse_uci_move, square_name, variation_to_uci,
+)
+from .search import (
+    INF, MATE_SCORE, MAX_PLY, AIWorker, ParallelSearch, SearchAborted, SearchContext, SearchStats,
+    TranspositionTable, iterative_deepening, minimax, principal_variation,
+)
@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from .board import START_FEN, GameState, move_to_uci, parse_uci_move
+from .book import OpeningBook
+from .search import MATE_BOUND, MATE_SCORE, MAX_PLY, SearchContext, TranspositionTable, iterative_deepening
+
+DEFAULT_DEPTH = 4
+SEARCH_FEATURES = {'quiescence': 'quiescence search', 'see': 'static exchange pruning of captures',
+                   'null_move': 'null-move pruning', 'lmr': 'late-move reductions',
+                   'tablebases': 'endgame tablebase probes', 'staged_moves': 'staged, lazy move generation'}
+
+def parse_position(text):
+    # "startpos|fen <FEN> [moves ...]", a bare FEN, or a bare move list
+    # played from the start position.
+    tokens = text.split()
+    if tokens[0] in ('startpos', 'fen'):
+        split = tokens.index('moves') if 'moves' in tokens else len(tokens)
+        setup, moves = tokens[1:split], tokens[split + 1:]
+        if bool(setup) != (tokens[0] == 'fen'):
+            raise ValueError('invalid position: ' + text)
+    elif '/' in tokens[0]:
+        setup, moves = tokens, []
+    else:
+        setup, moves = [], tokens
+    state = GameState.from_fen(' '.join(setup) if setup else START_FEN)
+    for move in moves:
+        state.push(parse_uci_move(state, move))
+    return state
+
+_batch_ctx = None
+_batch_book = None
+
+def _init_batch_worker(tt_mb, book_path, features):
+    global _batch_ctx, _batch_book
+    _batch_ctx = SearchContext(TranspositionTable(tt_mb))
+    for name, enabled in (features or {}).items():
+        setattr(_batch_ctx, 'use_' + name, enabled)
+    _batch_book = OpeningBook(book_path) if book_path else None
+
+def _analyse(lineno, text, depth, time_limit):
+    result = {'line': lineno, 'input': text}
+    try:
+        state = parse_position(text)
+    except (ValueError, KeyError, IndexError) as e:
+        result['error'] = str(e)
+        return result
+    result['fen'] = state.fen()
+    move = _batch_book.choose(state) if _batch_book else None
+    if move:
+        result['best'] = move_to_uci(move)
+        result['book'] = True
+        return result
+    start = time.perf_counter()
+    try:
+        score, move = iterative_deepening(state, time_limit, depth, ctx=_batch_ctx)
+    except Exception as e:
+        # One position the engine cannot handle must not end the whole run.
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        return result
+    result['best'] = move_to_uci(move) if move else None
+    result['score'] = score
+    if abs(score) > MATE_BOUND:
+        moves = (MATE_SCORE - abs(score) + 1) // 2
+        result['mate'] = moves if score > 0 else -moves
+    result['depth'] = _batch_ctx.completed_depth
+    result['nodes'] = _batch_ctx.nodes
+    result['qnodes'] = _batch_ctx.qnodes
+    result['pv'] = _batch_ctx.search_stats.pv
+    result['time'] = round(time.perf_counter() - start, 4)
+    return result
+
+def read_finished(path):
+    # Collects the input line numbers already present in an output file and
+    # cuts off a trailing record left half-written by an interrupted run.
+    done = set()
+    if not os.path.exists(path):
+        return done
+    good = 0
+    with open(path, 'rb+') as f:
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            try:
+                done.add(json.loads(raw)['line'])
+            except (ValueError, KeyError):
+                break
+            good += len(raw)
+        f.truncate(good)
+    return done
+
+def read_jobs(f, done):
+    for lineno, line in enumerate(f, 1):
+        text = line.strip()
+        if text and not text.startswith('#') and lineno not in done:
+            yield lineno, text
+
+def run_batch(jobs, out, workers=None, depth=None, time_limit=None, tt_mb=16,
+              max_pending=None, book_path=None, features=None):
+    from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    if depth is None:
+        depth = MAX_PLY if time_limit else DEFAULT_DEPTH
+    completed = 0
+
+    def drain(pending, return_when):
+        nonlocal completed
+        finished, pending = wait(pending, return_when=return_when)
+        for future in finished:
+            out.write(json.dumps(future.result()) + '\n')
+            completed += 1
+        out.flush()
+        return pending
+
+    with ProcessPoolExecutor(workers, initializer=_init_batch_worker, initargs=(tt_mb, book_path, features)) as executor:
+        pending = set()
+        for lineno, text in jobs:
+            if len(pending) >= max_pending:
+                pending = drain(pending, FIRST_COMPLETED)
+            pending.add(executor.submit(_analyse, lineno, text, depth, time_limit))
+        if pending:
+            drain(pending, ALL_COMPLETED)
+    return completed
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Analyse a file of positions (one FEN or UCI move list per line) and write JSONL results.')
+    parser.add_argument('input', help="input file, or '-' for standard input")
+    parser.add_argument('-o', '--output', help='JSONL output file (default: standard output)')
+    parser.add_argument('--depth', type=int, help='search depth (default %d)' % DEFAULT_DEPTH)
+    parser.add_argument('--movetime', type=float, help='time budget per position in seconds')
+    parser.add_argument('--workers', type=int, help='worker processes (default: CPU count)')
+    parser.add_argument('--hash', type=int, default=16, help='transposition table size per worker in MB')
+    parser.add_argument('--max-pending', type=int, help='positions in flight at once (default: 4 per worker)')
+    for feature, description in SEARCH_FEATURES.items():
+        parser.add_argument('--no-' + feature.replace('_', '-'), dest=feature, action='store_false',
+                            help='disable ' + description)
+    parser.add_argument('--book', help='answer positions found in this opening book without searching')
+    parser.add_argument('--resume', action='store_true', help='skip positions already in the output file')
+    args = parser.parse_args()
+
+    done = read_finished(args.output) if args.resume and args.output else set()
+    source = sys.stdin if args.input == '-' else open(args.input)
+    out = open(args.output, 'a' if args.resume else 'w') if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        count = run_batch(read_jobs(source, done), out, args.workers, args.depth, args.movetime,
+                          args.hash, args.max_pending, args.book,
+                          {feature: getattr(args, feature) for feature in SEARCH_FEATURES})
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print('%d positions in %.2fs (%d skipped)' % (count, elapsed, len(done)), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
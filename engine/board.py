@@ -0,0 +1,852 @@
+import random
+from collections import OrderedDict
+
+PIECES = 'PNBRQKpnbrqk'
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+STARTING_BOARD = [
+    ['r','n','b','q','k','b','n','r'],
+    ['p','p','p','p','p','p','p','p'],
+    ['.','.','.','.','.','.','.','.'],
+    ['.','.','.','.','.','.','.','.'],
+    ['.','.','.','.','.','.','.','.'],
+    ['.','.','.','.','.','.','.','.'],
+    ['P','P','P','P','P','P','P','P'],
+    ['R','N','B','Q','K','B','N','R']
+]
+
+SQUARES = [(r, c) for r in range(8) for c in range(8)]
+
+def in_bounds(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+def _step_table(deltas):
+    table = []
+    for r, c in SQUARES:
+        bb = 0
+        for dr, dc in deltas:
+            nr, nc = r + dr, c + dc
+            if in_bounds(nr, nc):
+                bb |= 1 << (nr * 8 + nc)
+        table.append(bb)
+    return table
+
+def _ray_table(dr, dc):
+    table = []
+    for r, c in SQUARES:
+        bb = 0
+        nr, nc = r + dr, c + dc
+        while in_bounds(nr, nc):
+            bb |= 1 << (nr * 8 + nc)
+            nr += dr
+            nc += dc
+        table.append(bb)
+    return table
+
+KNIGHT_ATTACKS = _step_table([(2,1),(2,-1),(-2,1),(-2,-1),(1,2),(1,-2),(-1,2),(-1,-2)])
+KING_ATTACKS = _step_table([(1,0),(-1,0),(0,1),(0,-1),(1,1),(1,-1),(-1,1),(-1,-1)])
+PAWN_ATTACKS = [_step_table([(1,-1),(1,1)]), _step_table([(-1,-1),(-1,1)])]
+
+RAY_N = _ray_table(-1, 0)
+RAY_S = _ray_table(1, 0)
+RAY_W = _ray_table(0, -1)
+RAY_E = _ray_table(0, 1)
+RAY_NW = _ray_table(-1, -1)
+RAY_NE = _ray_table(-1, 1)
+RAY_SW = _ray_table(1, -1)
+RAY_SE = _ray_table(1, 1)
+
+ROOK_RAYS = [RAY_N[sq] | RAY_S[sq] | RAY_W[sq] | RAY_E[sq] for sq in range(64)]
+BISHOP_RAYS = [RAY_NW[sq] | RAY_NE[sq] | RAY_SW[sq] | RAY_SE[sq] for sq in range(64)]
+
+def _between_table():
+    table = [[0] * 64 for _ in range(64)]
+    for rays in (RAY_N, RAY_S, RAY_W, RAY_E, RAY_NW, RAY_NE, RAY_SW, RAY_SE):
+        for sq in range(64):
+            targets = rays[sq]
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                to = bit.bit_length() - 1
+                table[sq][to] = rays[sq] & ~rays[to] & ~bit
+    return table
+
+BETWEEN = _between_table()
+
+# Castling rights are a 4-bit int, one bit per flag in CASTLING_FLAGS order.
+# CASTLING_MASKS gives the rights lost when a piece leaves or lands on a
+# square.
+CASTLING_FLAGS = 'KQkq'
+CASTLE_WHITE_KING, CASTLE_WHITE_QUEEN, CASTLE_BLACK_KING, CASTLE_BLACK_QUEEN = 1, 2, 4, 8
+ALL_CASTLING = 15
+CASTLING_MASKS = [0] * 64
+CASTLING_MASKS[63] = CASTLE_WHITE_KING
+CASTLING_MASKS[56] = CASTLE_WHITE_QUEEN
+CASTLING_MASKS[60] = CASTLE_WHITE_KING | CASTLE_WHITE_QUEEN
+CASTLING_MASKS[7] = CASTLE_BLACK_KING
+CASTLING_MASKS[0] = CASTLE_BLACK_QUEEN
+CASTLING_MASKS[4] = CASTLE_BLACK_KING | CASTLE_BLACK_QUEEN
+# The king and rook squares each right needs, in CASTLING_FLAGS order.
+CASTLING_HOMES = ((60, 'K', 63, 'R'), (60, 'K', 56, 'R'), (4, 'k', 7, 'r'), (4, 'k', 0, 'r'))
+
+# A move is a 16-bit int: the target square in bits 0-5, the origin square
+# in bits 6-11 and the promotion piece (an index into PROMOTION_PIECES) in
+# bits 12-14, 0 for other moves. Squares count from a8 = 0 to h1 = 63. The
+# engine only generates queen promotions. NO_SQUARE marks a missing en
+# passant square; a8 can never be one.
+PROMOTION_PIECES = '.nbrq'
+PROMOTE_QUEEN = 4
+PROMOTION_MOVE = PROMOTE_QUEEN << 12
+BACK_RANKS = 0xFF | 0xFF << 56
+ALL_SQUARES = (1 << 64) - 1
+NO_SQUARE = 0
+
+def rook_attacks(sq, occ):
+    attacks = 0
+    for rays in (RAY_S, RAY_E):
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in (RAY_N, RAY_W):
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+def bishop_attacks(sq, occ):
+    attacks = 0
+    for rays in (RAY_SE, RAY_SW):
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in (RAY_NW, RAY_NE):
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+def square_name(sq):
+    return 'abcdefgh'[sq & 7] + str(8 - (sq >> 3))
+
+def parse_square(name):
+    if len(name) != 2 or name[0] not in 'abcdefgh' or name[1] not in '12345678':
+        raise ValueError('invalid square: ' + name)
+    return (8 - int(name[1])) * 8 + 'abcdefgh'.index(name[0])
+
+def encode_move(from_pos, to_pos, promotion=0):
+    (r1, c1), (r2, c2) = from_pos, to_pos
+    return promotion << 12 | (r1 * 8 + c1) << 6 | (r2 * 8 + c2)
+
+def decode_move(move):
+    # ((from row, from col), (to row, to col)), as used by the window.
+    return SQUARES[move >> 6 & 63], SQUARES[move & 63]
+
+def move_to_uci(move):
+    text = square_name(move >> 6 & 63) + square_name(move & 63)
+    if move >> 12:
+        text += PROMOTION_PIECES[move >> 12]
+    return text
+
+def variation_to_uci(moves):
+    return [move_to_uci(move) for move in moves]
+
+def popcount(bb):
+    return bin(bb).count('1')
+
+MG_VALUES = {'p': 100, 'n': 320, 'b': 330, 'r': 500, 'q': 900, 'k': 0}
+EG_VALUES = {'p': 120, 'n': 300, 'b': 320, 'r': 520, 'q': 920, 'k': 0}
+PHASE_WEIGHTS = {'P': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0,
+                 'p': 0, 'n': 1, 'b': 1, 'r': 2, 'q': 4, 'k': 0}
+MAX_PHASE = 24
+
+PAWN_TABLE = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+     5,  5, 10, 25, 25, 10,  5,  5,
+     0,  0,  0, 20, 20,  0,  0,  0,
+     5, -5,-10,  0,  0,-10, -5,  5,
+     5, 10, 10,-20,-20, 10, 10,  5,
+     0,  0,  0,  0,  0,  0,  0,  0]
+PAWN_EG_TABLE = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    90, 90, 90, 90, 90, 90, 90, 90,
+    60, 60, 60, 60, 60, 60, 60, 60,
+    35, 35, 35, 35, 35, 35, 35, 35,
+    20, 20, 20, 20, 20, 20, 20, 20,
+    10, 10, 10, 10, 10, 10, 10, 10,
+     0,  0,  0,  0,  0,  0,  0,  0,
+     0,  0,  0,  0,  0,  0,  0,  0]
+KNIGHT_TABLE = [
+   -50,-40,-30,-30,-30,-30,-40,-50,
+   -40,-20,  0,  0,  0,  0,-20,-40,
+   -30,  0, 10, 15, 15, 10,  0,-30,
+   -30,  5, 15, 20, 20, 15,  5,-30,
+   -30,  0, 15, 20, 20, 15,  0,-30,
+   -30,  5, 10, 15, 15, 10,  5,-30,
+   -40,-20,  0,  5,  5,  0,-20,-40,
+   -50,-40,-30,-30,-30,-30,-40,-50]
+BISHOP_TABLE = [
+   -20,-10,-10,-10,-10,-10,-10,-20,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -10,  0,  5, 10, 10,  5,  0,-10,
+   -10,  5,  5, 10, 10,  5,  5,-10,
+   -10,  0, 10, 10, 10, 10,  0,-10,
+   -10, 10, 10, 10, 10, 10, 10,-10,
+   -10,  5,  0,  0,  0,  0,  5,-10,
+   -20,-10,-10,-10,-10,-10,-10,-20]
+ROOK_TABLE = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+     5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+     0,  0,  0,  5,  5,  0,  0,  0]
+QUEEN_TABLE = [
+   -20,-10,-10, -5, -5,-10,-10,-20,
+   -10,  0,  0,  0,  0,  0,  0,-10,
+   -10,  0,  5,  5,  5,  5,  0,-10,
+    -5,  0,  5,  5,  5,  5,  0, -5,
+     0,  0,  5,  5,  5,  5,  0, -5,
+   -10,  5,  5,  5,  5,  5,  0,-10,
+   -10,  0,  5,  0,  0,  0,  0,-10,
+   -20,-10,-10, -5, -5,-10,-10,-20]
+KING_MG_TABLE = [
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -30,-40,-40,-50,-50,-40,-40,-30,
+   -20,-30,-30,-40,-40,-30,-30,-20,
+   -10,-20,-20,-20,-20,-20,-20,-10,
+    20, 20,  0,  0,  0,  0, 20, 20,
+    20, 30, 10,  0,  0, 10, 30, 20]
+KING_EG_TABLE = [
+   -50,-40,-30,-20,-20,-30,-40,-50,
+   -30,-20,-10,  0,  0,-10,-20,-30,
+   -30,-10, 20, 30, 30, 20,-10,-30,
+   -30,-10, 30, 40, 40, 30,-10,-30,
+   -30,-10, 30, 40, 40, 30,-10,-30,
+   -30,-10, 20, 30, 30, 20,-10,-30,
+   -30,-30,  0,  0,  0,  0,-30,-30,
+   -50,-30,-30,-30,-30,-30,-30,-50]
+
+def _piece_square_tables(values, tables):
+    pst = {'.': [0] * 64}
+    for p, table in tables.items():
+        pst[p.upper()] = [values[p] + table[sq] for sq in range(64)]
+        pst[p] = [-values[p] - table[sq ^ 56] for sq in range(64)]
+    return pst
+
+PST_MG = _piece_square_tables(MG_VALUES, {'p': PAWN_TABLE, 'n': KNIGHT_TABLE, 'b': BISHOP_TABLE,
+                                          'r': ROOK_TABLE, 'q': QUEEN_TABLE, 'k': KING_MG_TABLE})
+PST_EG = _piece_square_tables(EG_VALUES, {'p': PAWN_EG_TABLE, 'n': KNIGHT_TABLE, 'b': BISHOP_TABLE,
+                                          'r': ROOK_TABLE, 'q': QUEEN_TABLE, 'k': KING_EG_TABLE})
+
+_zobrist_rng = random.Random(0x5EED)
+ZOBRIST_PIECES = {p: [_zobrist_rng.getrandbits(64) for _ in range(64)] for p in PIECES}
+ZOBRIST_CASTLING = {f: _zobrist_rng.getrandbits(64) for f in 'KQkq'}
+ZOBRIST_EP = [_zobrist_rng.getrandbits(64) for _ in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+CASTLING_KEYS = [0] * 16
+for _rights in range(16):
+    for _i, _flag in enumerate(CASTLING_FLAGS):
+        if _rights >> _i & 1:
+            CASTLING_KEYS[_rights] ^= ZOBRIST_CASTLING[_flag]
+
+def compute_zobrist(state):
+    key = 0
+    for sq, p in enumerate(state.squares):
+        if p != '.':
+            key ^= ZOBRIST_PIECES[p][sq]
+    key ^= CASTLING_KEYS[state.castling]
+    if state.ep_square:
+        key ^= ZOBRIST_EP[state.ep_square & 7]
+    if not state.white_turn:
+        key ^= ZOBRIST_BLACK_TO_MOVE
+    return key
+
+class GameState:
+    __slots__ = ('squares', 'pieces', 'occupancy', 'white_turn', 'castling', 'ep_square', 'last_move',
+                 'undo_stack', 'zobrist', 'mg_score', 'eg_score', 'phase')
+
+    def __init__(self):
+        self.set_squares([p for row in STARTING_BOARD for p in row])
+        self.white_turn = True
+        self.castling = ALL_CASTLING
+        self.ep_square = NO_SQUARE
+        self.last_move = None
+        self.undo_stack = []
+        self.zobrist = compute_zobrist(self)
+
+    @classmethod
+    def from_fen(cls, fen):
+        """The position of a FEN. Castling rights whose king or rook is not
+        on its start square are dropped, as is an en passant square no pawn
+        could have just double-pushed past; anything else invalid raises
+        ValueError."""
+        fields = fen.split()
+        if not fields:
+            raise ValueError('invalid FEN: ' + fen)
+        squares = []
+        for row in fields[0].split('/'):
+            for ch in row:
+                if ch.isdigit():
+                    squares.extend('.' * int(ch))
+                elif ch in PIECES:
+                    squares.append(ch)
+                else:
+                    raise ValueError('invalid FEN: ' + fen)
+        if len(squares) != 64:
+            raise ValueError('invalid FEN: ' + fen)
+        if squares.count('K') != 1 or squares.count('k') != 1:
+            raise ValueError('invalid FEN: %s (each side needs one king)' % fen)
+        if any(p in 'Pp' for p in squares[:8] + squares[56:]):
+            raise ValueError('invalid FEN: %s (pawn on a back rank)' % fen)
+
+        turn = fields[1] if len(fields) > 1 else 'w'
+        if turn not in ('w', 'b'):
+            raise ValueError('invalid FEN: ' + fen)
+
+        state = cls()
+        state.set_squares(squares)
+        state.white_turn = turn == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        if castling != '-' and not set(castling) <= set(CASTLING_FLAGS):
+            raise ValueError('invalid FEN: ' + fen)
+        state.castling = 0
+        for i, (king, k, rook, r) in enumerate(CASTLING_HOMES):
+            if CASTLING_FLAGS[i] in castling and squares[king] == k and squares[rook] == r:
+                state.castling |= 1 << i
+        ep = fields[3] if len(fields) > 3 else '-'
+        if ep != '-':
+            sq = parse_square(ep)
+            # The pushed pawn is one square past sq, and it started one
+            # square behind it.
+            pushed, start = (sq + 8, sq - 8) if state.white_turn else (sq - 8, sq + 8)
+            if sq >> 3 != (2 if state.white_turn else 5):
+                raise ValueError('invalid FEN: %s (en passant square on the wrong rank)' % fen)
+            if squares[pushed] == ('p' if state.white_turn else 'P') and squares[sq] == squares[start] == '.':
+                state.ep_square = sq
+        state.zobrist = compute_zobrist(state)
+        return state
+
+    def fen(self):
+        rows = []
+        for r in range(8):
+            row = ''
+            empty = 0
+            for p in self.squares[r * 8:r * 8 + 8]:
+                if p == '.':
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += p
+            rows.append(row + (str(empty) if empty else ''))
+        castling = ''.join(f for i, f in enumerate(CASTLING_FLAGS) if self.castling >> i & 1) or '-'
+        ep = square_name(self.ep_square) if self.ep_square else '-'
+        return '%s %s %s %s 0 1' % ('/'.join(rows), 'w' if self.white_turn else 'b', castling, ep)
+
+    def set_squares(self, squares):
+        self.squares = squares
+        self.pieces = dict.fromkeys(PIECES, 0)
+        self.occupancy = [0, 0]
+        self.mg_score = 0
+        self.eg_score = 0
+        self.phase = 0
+        for sq, p in enumerate(squares):
+            if p != '.':
+                self.pieces[p] |= 1 << sq
+                self.occupancy[p.isupper()] |= 1 << sq
+                self.mg_score += PST_MG[p][sq]
+                self.eg_score += PST_EG[p][sq]
+                self.phase += PHASE_WEIGHTS[p]
+
+    def piece_at(self, r, c):
+        return self.squares[r * 8 + c]
+
+    def push(self, move):
+        frm = move >> 6 & 63
+        to = move & 63
+        squares = self.squares
+        pieces = self.pieces
+        occupancy = self.occupancy
+        white = self.white_turn
+        piece = squares[frm]
+        captured = squares[to]
+        rights = self.castling
+        ep = self.ep_square
+        key = self.zobrist
+        mg = self.mg_score
+        eg = self.eg_score
+        self.undo_stack.append((move, piece, captured, rights, ep, self.last_move, key, mg, eg, self.phase))
+
+        from_bit = 1 << frm
+        to_bit = 1 << to
+        if captured != '.':
+            pieces[captured] ^= to_bit
+            occupancy[not white] ^= to_bit
+            key ^= ZOBRIST_PIECES[captured][to]
+            mg -= PST_MG[captured][to]
+            eg -= PST_EG[captured][to]
+            self.phase -= PHASE_WEIGHTS[captured]
+        if ep:
+            key ^= ZOBRIST_EP[ep & 7]
+
+        placed = piece
+        if piece == 'P' or piece == 'p':
+            if ep and to == ep:
+                cap_sq = (frm & 56) | (to & 7)
+                cap_bit = 1 << cap_sq
+                pawn = squares[cap_sq]
+                key ^= ZOBRIST_PIECES[pawn][cap_sq]
+                mg -= PST_MG[pawn][cap_sq]
+                eg -= PST_EG[pawn][cap_sq]
+                pieces[pawn] ^= cap_bit
+                occupancy[not white] ^= cap_bit
+                squares[cap_sq] = '.'
+            if to_bit & BACK_RANKS:
+                # Moves built without a promotion piece still promote to a queen.
+                placed = PROMOTION_PIECES[move >> 12 or PROMOTE_QUEEN]
+                if white:
+                    placed = placed.upper()
+                self.phase += PHASE_WEIGHTS[placed]
+            if to - frm == 16 or frm - to == 16:
+                self.ep_square = (frm + to) >> 1
+                key ^= ZOBRIST_EP[frm & 7]
+            else:
+                self.ep_square = NO_SQUARE
+        else:
+            self.ep_square = NO_SQUARE
+            if (piece == 'K' or piece == 'k') and (to - frm == 2 or frm - to == 2):
+                if to > frm:
+                    rook_from, rook_to = frm + 3, frm + 1
+                else:
+                    rook_from, rook_to = frm - 4, frm - 1
+                rook = squares[rook_from]
+                rook_bits = (1 << rook_from) | (1 << rook_to)
+                pieces[rook] ^= rook_bits
+                occupancy[white] ^= rook_bits
+                squares[rook_to] = rook
+                squares[rook_from] = '.'
+                key ^= ZOBRIST_PIECES[rook][rook_from] ^ ZOBRIST_PIECES[rook][rook_to]
+                mg += PST_MG[rook][rook_to] - PST_MG[rook][rook_from]
+                eg += PST_EG[rook][rook_to] - PST_EG[rook][rook_from]
+
+        pieces[piece] ^= from_bit
+        pieces[placed] ^= to_bit
+        occupancy[white] ^= from_bit | to_bit
+        squares[to] = placed
+        squares[frm] = '.'
+        key ^= ZOBRIST_PIECES[piece][frm] ^ ZOBRIST_PIECES[placed][to] ^ ZOBRIST_BLACK_TO_MOVE
+        self.mg_score = mg + PST_MG[placed][to] - PST_MG[piece][frm]
+        self.eg_score = eg + PST_EG[placed][to] - PST_EG[piece][frm]
+
+        lost = rights & (CASTLING_MASKS[frm] | CASTLING_MASKS[to])
+        if lost:
+            self.castling = rights ^ lost
+            key ^= CASTLING_KEYS[lost]
+
+        self.zobrist = key
+        self.last_move = move
+        self.white_turn = not white
+
+    def push_null(self):
+        ep = self.ep_square
+        key = self.zobrist
+        self.undo_stack.append((None, None, None, self.castling, ep, self.last_move, key,
+                                self.mg_score, self.eg_score, self.phase))
+        if ep:
+            key ^= ZOBRIST_EP[ep & 7]
+            self.ep_square = NO_SQUARE
+        self.zobrist = key ^ ZOBRIST_BLACK_TO_MOVE
+        self.last_move = None
+        self.white_turn = not self.white_turn
+
+    def pop(self):
+        move, piece, captured, rights, ep, last_move, key, mg, eg, phase = self.undo_stack.pop()
+        if move is None:
+            self.ep_square = ep
+            self.last_move = last_move
+            self.white_turn = not self.white_turn
+            self.zobrist = key
+            return
+        frm = move >> 6 & 63
+        to = move & 63
+        squares = self.squares
+        pieces = self.pieces
+        occupancy = self.occupancy
+        white = not self.white_turn
+
+        from_bit = 1 << frm
+        to_bit = 1 << to
+        pieces[squares[to]] ^= to_bit
+        pieces[piece] ^= from_bit
+        occupancy[white] ^= from_bit | to_bit
+        squares[frm] = piece
+        squares[to] = captured
+        if captured != '.':
+            pieces[captured] ^= to_bit
+            occupancy[not white] ^= to_bit
+
+        if piece == 'P' or piece == 'p':
+            if ep and to == ep:
+                cap_sq = (frm & 56) | (to & 7)
+                cap_bit = 1 << cap_sq
+                pawn = 'p' if white else 'P'
+                pieces[pawn] ^= cap_bit
+                occupancy[not white] ^= cap_bit
+                squares[cap_sq] = pawn
+        elif (piece == 'K' or piece == 'k') and (to - frm == 2 or frm - to == 2):
+            if to > frm:
+                rook_from, rook_to = frm + 3, frm + 1
+            else:
+                rook_from, rook_to = frm - 4, frm - 1
+            rook = squares[rook_to]
+            rook_bits = (1 << rook_from) | (1 << rook_to)
+            pieces[rook] ^= rook_bits
+            occupancy[white] ^= rook_bits
+            squares[rook_from] = rook
+            squares[rook_to] = '.'
+
+        self.castling = rights
+        self.ep_square = ep
+        self.last_move = last_move
+        self.white_turn = white
+        self.zobrist = key
+        self.mg_score = mg
+        self.eg_score = eg
+        self.phase = phase
+
+    def copy(self):
+        new_state = GameState.__new__(GameState)
+        new_state.squares = self.squares[:]
+        new_state.pieces = self.pieces.copy()
+        new_state.occupancy = self.occupancy[:]
+        new_state.white_turn = self.white_turn
+        new_state.castling = self.castling
+        new_state.ep_square = self.ep_square
+        new_state.last_move = self.last_move
+        new_state.undo_stack = []
+        new_state.zobrist = self.zobrist
+        new_state.mg_score = self.mg_score
+        new_state.eg_score = self.eg_score
+        new_state.phase = self.phase
+        return new_state
+
+def is_white(p):
+    return p.isupper()
+
+def is_black(p):
+    return p.islower()
+
+def find_king(state, white):
+    king = state.pieces['K' if white else 'k']
+    if not king:
+        return None
+    return SQUARES[king.bit_length() - 1]
+
+def is_attacked(state, sq, by_white, occ=None):
+    pieces = state.pieces
+    if by_white:
+        pawn, knight, bishop, rook, queen, king = 'P', 'N', 'B', 'R', 'Q', 'K'
+    else:
+        pawn, knight, bishop, rook, queen, king = 'p', 'n', 'b', 'r', 'q', 'k'
+
+    if PAWN_ATTACKS[not by_white][sq] & pieces[pawn]:
+        return True
+    if KNIGHT_ATTACKS[sq] & pieces[knight]:
+        return True
+    if KING_ATTACKS[sq] & pieces[king]:
+        return True
+
+    if occ is None:
+        occ = state.occupancy[0] | state.occupancy[1]
+    rook_queen = pieces[rook] | pieces[queen]
+    if rook_queen and rook_attacks(sq, occ) & rook_queen:
+        return True
+    bishop_queen = pieces[bishop] | pieces[queen]
+    if bishop_queen and bishop_attacks(sq, occ) & bishop_queen:
+        return True
+
+    return False
+
+def attackers_to(state, sq, by_white, occ):
+    pieces = state.pieces
+    if by_white:
+        pawn, knight, bishop, rook, queen, king = 'P', 'N', 'B', 'R', 'Q', 'K'
+    else:
+        pawn, knight, bishop, rook, queen, king = 'p', 'n', 'b', 'r', 'q', 'k'
+    return ((PAWN_ATTACKS[not by_white][sq] & pieces[pawn]) |
+            (KNIGHT_ATTACKS[sq] & pieces[knight]) |
+            (KING_ATTACKS[sq] & pieces[king]) |
+            (rook_attacks(sq, occ) & (pieces[rook] | pieces[queen])) |
+            (bishop_attacks(sq, occ) & (pieces[bishop] | pieces[queen])))
+
+def check_info(state):
+    white = state.white_turn
+    pieces = state.pieces
+    king = pieces['K' if white else 'k']
+    if not king:
+        return None, 0, {}
+    king_sq = king.bit_length() - 1
+    own = state.occupancy[white]
+    occ = own | state.occupancy[not white]
+    checkers = attackers_to(state, king_sq, not white, occ)
+
+    if white:
+        rook_queen = pieces['r'] | pieces['q']
+        bishop_queen = pieces['b'] | pieces['q']
+    else:
+        rook_queen = pieces['R'] | pieces['Q']
+        bishop_queen = pieces['B'] | pieces['Q']
+    pins = {}
+    snipers = (ROOK_RAYS[king_sq] & rook_queen) | (BISHOP_RAYS[king_sq] & bishop_queen)
+    while snipers:
+        bit = snipers & -snipers
+        snipers ^= bit
+        between = BETWEEN[king_sq][bit.bit_length() - 1]
+        blockers = between & occ
+        if blockers & own and not blockers & (blockers - 1):
+            pins[blockers.bit_length() - 1] = between | bit
+    return king_sq, checkers, pins
+
+def is_in_check(state, white):
+    king = state.pieces['K' if white else 'k']
+    if not king:
+        return False
+    return is_attacked(state, king.bit_length() - 1, not white)
+
+def pseudo_legal_targets(state, sq):
+    piece = state.squares[sq]
+    if piece == '.':
+        return 0
+
+    color_white = piece.isupper()
+    own = state.occupancy[color_white]
+    enemy = state.occupancy[not color_white]
+    occ = own | enemy
+    p = piece.lower()
+
+    if p == 'p':
+        targets = PAWN_ATTACKS[color_white][sq] & enemy
+        if state.ep_square:
+            targets |= PAWN_ATTACKS[color_white][sq] & (1 << state.ep_square)
+        step = sq - 8 if color_white else sq + 8
+        if not (occ >> step) & 1:
+            targets |= 1 << step
+            if sq >> 3 == (6 if color_white else 1):
+                step = step - 8 if color_white else step + 8
+                if not (occ >> step) & 1:
+                    targets |= 1 << step
+        return targets
+
+    if p == 'n':
+        return KNIGHT_ATTACKS[sq] & ~own
+    if p == 'b':
+        return bishop_attacks(sq, occ) & ~own
+    if p == 'r':
+        return rook_attacks(sq, occ) & ~own
+    if p == 'q':
+        return (rook_attacks(sq, occ) | bishop_attacks(sq, occ)) & ~own
+
+    targets = KING_ATTACKS[sq] & ~own
+    home = 60 if color_white else 4
+    if sq == home and not is_attacked(state, sq, not color_white):
+        rights = state.castling
+        if (rights & (CASTLE_WHITE_KING if color_white else CASTLE_BLACK_KING) and not occ & (0b11 << (home + 1)) and
+            not is_attacked(state, home + 1, not color_white) and
+            not is_attacked(state, home + 2, not color_white)):
+            targets |= 1 << (home + 2)
+        if (rights & (CASTLE_WHITE_QUEEN if color_white else CASTLE_BLACK_QUEEN) and not occ & (0b111 << (home - 3)) and
+            not is_attacked(state, home - 1, not color_white) and
+            not is_attacked(state, home - 2, not color_white)):
+            targets |= 1 << (home - 2)
+    return targets
+
+def get_pseudo_legal_moves(state, r, c):
+    moves = []
+    targets = pseudo_legal_targets(state, r * 8 + c)
+    while targets:
+        bit = targets & -targets
+        moves.append(SQUARES[bit.bit_length() - 1])
+        targets ^= bit
+    return moves
+
+def legal_targets(state, sq, info, mask=ALL_SQUARES):
+    # Only targets in mask are checked for legality.
+    king_sq, checkers, pins = info
+    targets = pseudo_legal_targets(state, sq) & mask
+    if not targets:
+        return 0
+    white = state.white_turn
+
+    if sq == king_sq:
+        occ = (state.occupancy[0] | state.occupancy[1]) ^ (1 << sq)
+        steps = targets & KING_ATTACKS[sq]
+        targets ^= steps
+        while steps:
+            bit = steps & -steps
+            steps ^= bit
+            if not is_attacked(state, bit.bit_length() - 1, not white, occ):
+                targets |= bit
+        return targets
+
+    if checkers & (checkers - 1):
+        return 0
+
+    ep_bit = 0
+    piece = state.squares[sq]
+    if (piece == 'P' or piece == 'p') and state.ep_square:
+        ep_bit = targets & (1 << state.ep_square)
+        targets ^= ep_bit
+
+    if checkers:
+        targets &= checkers | BETWEEN[king_sq][checkers.bit_length() - 1]
+    if sq in pins:
+        targets &= pins[sq]
+
+    if ep_bit:
+        state.push(sq << 6 | state.ep_square)
+        if not is_in_check(state, white):
+            targets |= ep_bit
+        state.pop()
+    return targets
+
+def get_legal_moves(state, r, c):
+    sq = r * 8 + c
+    if not (state.occupancy[state.white_turn] >> sq) & 1:
+        return []
+    legal_moves = []
+    targets = legal_targets(state, sq, check_info(state))
+    while targets:
+        bit = targets & -targets
+        legal_moves.append(SQUARES[bit.bit_length() - 1])
+        targets ^= bit
+    return legal_moves
+
+def make_move(state, from_pos, to_pos, validate=True):
+    move = encode_move(from_pos, to_pos)
+    if state.squares[move >> 6 & 63] in 'Pp' and 1 << (move & 63) & BACK_RANKS:
+        move |= PROMOTION_MOVE
+    new_state = state.copy()
+    new_state.push(move)
+    return new_state
+
+def all_legal_moves(state):
+    return generate_moves(state, check_info(state))
+
+def generate_moves(state, info, mask=ALL_SQUARES, pawn_mask=ALL_SQUARES):
+    """Legal moves of the side to move whose target is in mask, or in
+    pawn_mask for pawns, so a caller can ask for captures or quiet moves
+    without checking the legality of the others."""
+    king_sq, checkers = info[0], info[1]
+    if checkers & (checkers - 1):
+        own = 1 << king_sq
+    else:
+        own = state.occupancy[state.white_turn]
+
+    pawns = state.pieces['P'] | state.pieces['p']
+    moves = []
+    while own:
+        bit = own & -own
+        own ^= bit
+        sq = bit.bit_length() - 1
+        if bit & pawns:
+            targets = legal_targets(state, sq, info, pawn_mask)
+            # A pawn that can reach the back rank can only move there.
+            base = sq << 6 | PROMOTION_MOVE if targets & BACK_RANKS else sq << 6
+        else:
+            targets = legal_targets(state, sq, info, mask)
+            base = sq << 6
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            moves.append(base | bit.bit_length() - 1)
+    return moves
+
+def parse_uci_move(state, text):
+    if len(text) not in (4, 5):
+        raise ValueError('invalid move: ' + text)
+    code = parse_square(text[:2]) << 6 | parse_square(text[2:4])
+    # The promotion letter is not checked; the engine always promotes to a queen.
+    for move in all_legal_moves(state):
+        if move & 0xFFF == code:
+            return move
+    raise ValueError('illegal move: ' + text)
+
+MOVE_CACHE_SIZE = 64
+
+class MoveCache:
+    """Legal moves of recently seen positions, keyed by Zobrist hash, so
+    selecting pieces, checking for the end of the game and starting a search
+    in the same position generate the moves only once. Each entry also
+    groups the targets by origin square for the window. The least recently
+    used position is dropped when full."""
+
+    def __init__(self, size=MOVE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, state):
+        key = state.zobrist
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        moves = all_legal_moves(state)
+        groups = {}
+        for move in moves:
+            groups.setdefault(SQUARES[move >> 6 & 63], []).append(SQUARES[move & 63])
+        entry = self.entries[key] = (moves, groups)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+    def moves(self, state):
+        # Shared with later callers; use all_moves for a list to modify.
+        return self.entry(state)[0]
+
+    def all_moves(self, state):
+        return self.entry(state)[0][:]
+
+    def legal_moves(self, state, r, c):
+        return self.entry(state)[1].get((r, c), [])
+
+    def is_checkmate(self, state):
+        return not self.moves(state) and is_in_check(state, state.white_turn)
+
+    def is_stalemate(self, state):
+        return not self.moves(state) and not is_in_check(state, state.white_turn)
+
+    def clear(self):
+        self.entries.clear()
+
+def is_checkmate(state):
+    if not is_in_check(state, state.white_turn):
+        return False
+    return len(all_legal_moves(state)) == 0
+
+def is_stalemate(state):
+    if is_in_check(state, state.white_turn):
+        return False
+    return len(all_legal_moves(state)) == 0
+
+def eval_board(state):
+    phase = min(state.phase, MAX_PHASE)
+    return (state.mg_score * phase + state.eg_score * (MAX_PHASE - phase)) // MAX_PHASE
@@ -0,0 +1,130 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+from .board import START_FEN, GameState, all_legal_moves, parse_uci_move
+
+# Book files use Polyglot's layout: 16-byte big-endian entries of
+# (key, move, weight, learn) sorted by key. Keys are this engine's Zobrist
+# hashes and moves are the engine's 16-bit moves, so the files are not interchangeable
+# with Polyglot books.
+ENTRY = struct.Struct('>QHHI')
+DEFAULT_BOOK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'book.bin')
+DEFAULT_BOOK_PLIES = 16
+
+class OpeningBook:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.entries = size // ENTRY.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def key_at(self, i):
+        return struct.unpack_from('>Q', self.data, i * ENTRY.size)[0]
+
+    def probe(self, key):
+        lo, hi = 0, self.entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        moves = []
+        while lo < self.entries:
+            entry_key, move, weight, _ = ENTRY.unpack_from(self.data, lo * ENTRY.size)
+            if entry_key != key:
+                break
+            moves.append((move, weight))
+            lo += 1
+        return moves
+
+    def choose(self, state, rng=random, move_cache=None):
+        # Weighted random pick among book moves that are legal here, so a
+        # hash collision can never make the engine play an illegal move.
+        candidates = self.probe(state.zobrist)
+        if not candidates:
+            return None
+        legal = move_cache.moves(state) if move_cache is not None else all_legal_moves(state)
+        moves = [(move, weight) for move, weight in candidates if weight and move in legal]
+        if not moves:
+            return None
+        pick = rng.randrange(sum(weight for _, weight in moves))
+        for move, weight in moves:
+            pick -= weight
+            if pick < 0:
+                return move
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_book(path=DEFAULT_BOOK_PATH):
+    try:
+        return OpeningBook(path)
+    except OSError:
+        return None
+
+def build_book(lines, plies=DEFAULT_BOOK_PLIES, min_count=1):
+    counts = {}
+    games = 0
+    for line in lines:
+        tokens = line.split()
+        if not tokens or tokens[0].startswith('#'):
+            continue
+        state = GameState.from_fen(START_FEN)
+        for text in tokens[:plies]:
+            try:
+                move = parse_uci_move(state, text)
+            except ValueError:
+                break
+            position = counts.setdefault(state.zobrist, {})
+            position[move] = position.get(move, 0) + 1
+            state.push(move)
+        games += 1
+
+    entries = []
+    for key, moves in counts.items():
+        for move, count in moves.items():
+            if count >= min_count:
+                entries.append((key, -count, move))
+    entries.sort()
+    data = bytearray(ENTRY.size * len(entries))
+    for i, (key, count, move) in enumerate(entries):
+        ENTRY.pack_into(data, i * ENTRY.size, key, move, min(-count, 0xFFFF), 0)
+    return bytes(data), games, len(counts)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build an opening book from a file of games (UCI move lists, one game per line).')
+    parser.add_argument('games', help="games file, or '-' for standard input")
+    parser.add_argument('-o', '--output', default=DEFAULT_BOOK_PATH, help='book file to write')
+    parser.add_argument('--plies', type=int, default=DEFAULT_BOOK_PLIES, help='moves per game to include')
+    parser.add_argument('--min-count', type=int, default=1,
+                        help='drop moves played fewer times than this')
+    args = parser.parse_args()
+
+    source = sys.stdin if args.games == '-' else open(args.games)
+    try:
+        data, games, positions = build_book(source, args.plies, args.min_count)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    print('%d games, %d positions, %d entries written to %s' % (
+        games, positions, len(data) // ENTRY.size, args.output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,459 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+from .board import GameState, compute_zobrist
+
+MAGIC = b'CHESSLOG'
+VERSION = 2
+FILE_HEADER = struct.Struct('>8sH')
+# Every record is (kind, game, payload length) followed by the payload. A
+# game is identified by the 64-bit file offset of its GAME record.
+RECORD = struct.Struct('>cQH')
+PLY = struct.Struct('>H')
+MAX_RECORD_MOVES = (0xFFFF - PLY.size) // 2
+
+GAME = b'G'        # JSON tags of a new game
+SNAPSHOT = b'S'    # ply, then the packed position after that many plies
+MOVES = b'M'       # first ply, then a block of 16-bit moves, one per ply
+TAKEBACK = b'U'    # ply the game was taken back to
+RESULT = b'R'      # JSON result and reason; the last record of a game
+
+SNAPSHOT_INTERVAL = 16
+PACKED_SIZE = 34
+PIECE_CODES = '.PNBRQKpnbrqk'
+PIECE_INDEX = {p: i for i, p in enumerate(PIECE_CODES)}
+DEFAULT_LOG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'games.log')
+
+def pack_position(state):
+    # Two squares per byte, then side to move and castling rights, then the
+    # en passant square: 34 bytes.
+    codes = [PIECE_INDEX[p] for p in state.squares]
+    data = bytes(codes[i] << 4 | codes[i + 1] for i in range(0, 64, 2))
+    return data + bytes((state.white_turn | state.castling << 1, state.ep_square))
+
+def unpack_position(data):
+    squares = []
+    for byte in data[:32]:
+        squares.append(PIECE_CODES[byte >> 4])
+        squares.append(PIECE_CODES[byte & 15])
+    state = GameState()
+    state.set_squares(squares)
+    state.white_turn = bool(data[32] & 1)
+    state.castling = data[32] >> 1
+    state.ep_square = data[33]
+    state.zobrist = compute_zobrist(state)
+    return state
+
+def _record(kind, game, payload):
+    return RECORD.pack(kind, game, len(payload)) + payload
+
+def _moves_payload(first, moves):
+    return PLY.pack(first) + struct.pack('>%dH' % len(moves), *moves)
+
+class GameRecord:
+    """The moves of one game with a packed snapshot of the position every
+    SNAPSHOT_INTERVAL plies, so position(ply) replays fewer than
+    SNAPSHOT_INTERVAL moves however long the game is. A record made by
+    GameLogWriter.new_game also appends its changes to the log: moves are
+    buffered and written as one block with each snapshot, and flushed by a
+    takeback or the result, so a crash loses at most the last
+    SNAPSHOT_INTERVAL - 1 plies of a game in progress."""
+
+    def __init__(self, start=None, tags=None, game_id=None, writer=None):
+        self.tags = dict(tags or {})
+        self.moves = array('H')
+        self.snapshots = [pack_position(start or GameState())]
+        self.result = None
+        self.reason = None
+        self.id = game_id
+        self.writer = writer
+        self.state = None
+        # Plies already in the log; later moves wait in memory.
+        self.flushed = 0
+
+    def __len__(self):
+        return len(self.moves)
+
+    def position(self, ply=None):
+        """A new GameState for the position after ply moves (by default
+        after the last one)."""
+        if ply is None:
+            ply = len(self.moves)
+        if not 0 <= ply <= len(self.moves):
+            raise IndexError('ply %d out of range 0-%d' % (ply, len(self.moves)))
+        index = ply // SNAPSHOT_INTERVAL
+        state = unpack_position(self.snapshots[index])
+        for move in self.moves[index * SNAPSHOT_INTERVAL:ply]:
+            state.push(move)
+        state.last_move = self.moves[ply - 1] if ply else None
+        return state
+
+    def replay(self):
+        # (position, move) for each ply; the position is one GameState that
+        # is updated in place, so copy it to keep it.
+        state = self.position(0)
+        for move in self.moves:
+            yield state, move
+            state.push(move)
+
+    def push(self, move):
+        if self.state is None:
+            self.state = self.position()
+        self.state.push(move)
+        self.moves.append(move)
+        ply = len(self.moves)
+        if ply % SNAPSHOT_INTERVAL == 0:
+            self.snapshots.append(pack_position(self.state))
+            self.flush()
+
+    def flush(self):
+        """Append the buffered moves, and any snapshot among them, in one
+        write."""
+        ply = len(self.moves)
+        if not self.writer or self.flushed == ply:
+            return
+        if self.id is None:
+            self.writer.begin(self)
+        parts = [_record(MOVES, self.id, _moves_payload(self.flushed, self.moves[self.flushed:]))]
+        first_snapshot = self.flushed // SNAPSHOT_INTERVAL + 1
+        for index in range(first_snapshot, ply // SNAPSHOT_INTERVAL + 1):
+            parts.append(_record(SNAPSHOT, self.id, PLY.pack(index * SNAPSHOT_INTERVAL) + self.snapshots[index]))
+        self.writer.append(b''.join(parts))
+        self.flushed = ply
+
+    def truncate(self, ply):
+        del self.moves[ply:]
+        del self.snapshots[ply // SNAPSHOT_INTERVAL + 1:]
+        self.state = None
+        self.result = self.reason = None
+
+    def takeback(self, plies=1):
+        """Remove the last plies moves and return the position before them."""
+        ply = max(0, len(self.moves) - plies)
+        self.truncate(ply)
+        if ply < self.flushed:
+            # Only moves already written need a TAKEBACK record.
+            self.writer.append(_record(TAKEBACK, self.id, PLY.pack(ply)))
+            self.flushed = ply
+        return self.position()
+
+    def finish(self, result, reason=None):
+        self.result, self.reason = result, reason
+        self.flush()
+        if self.writer and self.id is not None:
+            self.writer.append(_record(RESULT, self.id, json.dumps({'result': result, 'reason': reason}).encode()))
+
+def _scan(data):
+    # (offset, kind, game, payload start, payload length) for each complete
+    # record, without copying the payloads.
+    if len(data) < FILE_HEADER.size:
+        return
+    magic, version = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a game log')
+    if version != VERSION:
+        raise ValueError('unsupported game log version %d' % version)
+    offset = FILE_HEADER.size
+    end = len(data)
+    while offset + RECORD.size <= end:
+        kind, game, length = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        if start + length > end:
+            break
+        yield offset, kind, game, start, length
+        offset = start + length
+
+def read_records(data):
+    """(offset, kind, game, payload) for each complete record of a log. A
+    record cut short at the end of the data is ignored."""
+    for offset, kind, game, start, length in _scan(data):
+        yield offset, kind, game, data[start:start + length]
+
+class GameIndex:
+    """Where the records of one logged game lie: the offsets of its
+    snapshots and of each run of moves, so a position or the whole game is
+    decoded from the log only when asked for."""
+
+    __slots__ = ('data', 'id', 'plies', 'move_plies', 'move_offsets', 'snapshots', 'result')
+
+    def __init__(self, data, game_id):
+        self.data = data
+        self.id = game_id
+        self.plies = 0
+        # A run of moves starts at move_plies[i] and lasts until the next
+        # run starts; move_offsets[i] is where its first move is stored.
+        self.move_plies = array('I')
+        self.move_offsets = array('Q')
+        self.snapshots = array('Q')
+        self.result = None
+
+    def __len__(self):
+        return self.plies
+
+    def truncate(self, ply):
+        while self.move_plies and self.move_plies[-1] >= ply:
+            self.move_plies.pop()
+            self.move_offsets.pop()
+        del self.snapshots[ply // SNAPSHOT_INTERVAL + 1:]
+        self.plies = min(self.plies, ply)
+        self.result = None
+
+    def add(self, kind, start, length):
+        # Index one record of this game; True once its result is read.
+        data = self.data
+        if kind == MOVES:
+            first = PLY.unpack_from(data, start)[0]
+            if first > self.plies:
+                return False
+            self.truncate(first)
+            self.move_plies.append(first)
+            self.move_offsets.append(start + PLY.size)
+            self.plies = first + (length - PLY.size) // 2
+        elif kind == SNAPSHOT:
+            ply = PLY.unpack_from(data, start)[0]
+            index = ply // SNAPSHOT_INTERVAL
+            if ply % SNAPSHOT_INTERVAL == 0 and index <= len(self.snapshots):
+                del self.snapshots[index:]
+                self.snapshots.append(start + PLY.size)
+        elif kind == TAKEBACK:
+            self.truncate(PLY.unpack_from(data, start)[0])
+        elif kind == RESULT:
+            self.result = (start, length)
+            return True
+        return False
+
+    def moves(self, first=0, last=None):
+        """The moves from ply first up to ply last, read from the log."""
+        last = self.plies if last is None else min(last, self.plies)
+        moves = array('H')
+        i = max(0, bisect_right(self.move_plies, first) - 1)
+        while first < last and i < len(self.move_plies):
+            run_end = self.move_plies[i + 1] if i + 1 < len(self.move_plies) else self.plies
+            count = min(last, run_end) - first
+            if count > 0:
+                offset = self.move_offsets[i] + 2 * (first - self.move_plies[i])
+                moves.extend(struct.unpack_from('>%dH' % count, self.data, offset))
+                first += count
+            i += 1
+        return moves
+
+    def tags(self):
+        _, _, length = RECORD.unpack_from(self.data, self.id)
+        start = self.id + RECORD.size
+        return json.loads(self.data[start:start + length])
+
+    def position(self, ply=None):
+        """A new GameState for the position after ply moves, restored from
+        the nearest snapshot."""
+        if ply is None:
+            ply = self.plies
+        if not 0 <= ply <= self.plies:
+            raise IndexError('ply %d out of range 0-%d' % (ply, self.plies))
+        index = min(ply // SNAPSHOT_INTERVAL, len(self.snapshots) - 1)
+        if index < 0:
+            state, index = GameState(), 0
+        else:
+            offset = self.snapshots[index]
+            state = unpack_position(self.data[offset:offset + PACKED_SIZE])
+        moves = self.moves(index * SNAPSHOT_INTERVAL, ply)
+        for move in moves:
+            state.push(move)
+        state.last_move = moves[-1] if moves else self.moves(ply - 1, ply)[0] if ply else None
+        return state
+
+    def record(self):
+        """The whole game decoded into a GameRecord."""
+        record = GameRecord(self.position(0), self.tags(), game_id=self.id)
+        record.moves = self.moves()
+        for index in range(1, self.plies // SNAPSHOT_INTERVAL + 1):
+            if index < len(self.snapshots):
+                offset = self.snapshots[index]
+                record.snapshots.append(bytes(self.data[offset:offset + PACKED_SIZE]))
+            else:
+                # A snapshot lost with the end of the log.
+                record.snapshots.append(pack_position(self.position(index * SNAPSHOT_INTERVAL)))
+        if self.result:
+            start, length = self.result
+            result = json.loads(self.data[start:start + length])
+            record.result, record.reason = result['result'], result['reason']
+        return record
+
+def index_games(data):
+    """Yield a GameIndex for each game of a log, each finished game as soon
+    as its result is read and unfinished games at the end."""
+    games = {}
+    for _, kind, game_id, start, length in _scan(data):
+        if kind == GAME:
+            games[game_id] = GameIndex(data, game_id)
+            continue
+        game = games.get(game_id)
+        if game is not None and game.add(kind, start, length):
+            yield games.pop(game_id)
+    yield from games.values()
+
+def iter_games(data):
+    """Yield the games of a log as GameRecords, each finished game as soon as
+    its result is read and unfinished games at the end, so a large log can
+    be analysed without holding all of it."""
+    for game in index_games(data):
+        yield game.record()
+
+class GameLog:
+    """A game log opened through a memory map. Opening it only indexes
+    where each game's records lie; moves and positions are decoded from the
+    map when asked for, and position(game, ply) restores any position from
+    the nearest snapshot."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.games = sorted(index_games(self.data), key=lambda game: game.id)
+
+    def __len__(self):
+        return len(self.games)
+
+    def __getitem__(self, index):
+        return self.games[index].record()
+
+    def __iter__(self):
+        for game in self.games:
+            yield game.record()
+
+    def position(self, game, ply=None):
+        return self.games[game].position(ply)
+
+    def close(self):
+        self.games = []
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class GameLogWriter:
+    """Appends games to a log, creating it if needed. Only one writer may
+    have a log open at a time. A record left half written by a crash is cut
+    off when the log is next opened."""
+
+    def __init__(self, path=DEFAULT_LOG_PATH):
+        self.path = path
+        self.file = open(path, 'a+b')
+        size = self.file.seek(0, os.SEEK_END)
+        end = 0
+        if size:
+            data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                end = FILE_HEADER.size if size >= FILE_HEADER.size else 0
+                for _, _, _, start, length in _scan(data):
+                    end = start + length
+            finally:
+                data.close()
+        if end < size:
+            self.file.truncate(end)
+            self.file.seek(end)
+        if not end:
+            self.append(FILE_HEADER.pack(MAGIC, VERSION))
+
+    def append(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def new_game(self, start=None, tags=None):
+        """A GameRecord whose moves, takebacks and result are appended as
+        they happen. Nothing is written until the first move."""
+        return GameRecord(start, tags, writer=self)
+
+    def begin(self, record):
+        record.id = self.file.seek(0, os.SEEK_END)
+        self.append(_record(GAME, record.id, json.dumps(record.tags).encode()) +
+                    _record(SNAPSHOT, record.id, PLY.pack(0) + record.snapshots[0]))
+
+    def write_game(self, record):
+        """Append a whole game in one write and return its id."""
+        game_id = self.file.seek(0, os.SEEK_END)
+        parts = [_record(GAME, game_id, json.dumps(record.tags).encode())]
+        moves = record.moves
+        for first in range(0, len(moves), MAX_RECORD_MOVES):
+            parts.append(_record(MOVES, game_id, _moves_payload(first, moves[first:first + MAX_RECORD_MOVES])))
+        for index, snapshot in enumerate(record.snapshots):
+            parts.append(_record(SNAPSHOT, game_id, PLY.pack(index * SNAPSHOT_INTERVAL) + snapshot))
+        if record.result:
+            parts.append(_record(RESULT, game_id, json.dumps({'result': record.result,
+                                                              'reason': record.reason}).encode()))
+        self.append(b''.join(parts))
+        return game_id
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def describe(index, record):
+    tags = record.tags
+    return '%4d  %-10s  %s - %s  %s%s  %d plies' % (
+        index, tags.get('Date', '?'), tags.get('White', '?'), tags.get('Black', '?'), record.result or '*',
+        ' (%s)' % record.reason if record.reason else '', len(record))
+
+def main():
+    from .pgn import read_pgn, write_pgn
+
+    parser = argparse.ArgumentParser(description='List, export and import the games of a game log.')
+    parser.add_argument('log', nargs='?', default=DEFAULT_LOG_PATH, help='game log (default: games.log)')
+    parser.add_argument('--game', type=int, help='print this game (numbered from 0) as PGN')
+    parser.add_argument('--ply', type=int, help='with --game, print the FEN after this many plies instead')
+    parser.add_argument('--pgn', help="export every game to this PGN file ('-' for standard output)")
+    parser.add_argument('--import', dest='import_pgn', metavar='PGN', help='append the games of a PGN file')
+    args = parser.parse_args()
+
+    if args.import_pgn:
+        with open(args.import_pgn) as f, GameLogWriter(args.log) as writer:
+            count = 0
+            for record in read_pgn(f):
+                writer.write_game(record)
+                count += 1
+        print('%d games imported into %s' % (count, args.log))
+        return 0
+
+    with GameLog(args.log) as log:
+        if args.game is not None:
+            if not 0 <= args.game < len(log):
+                parser.error('no game %d; the log has %d games' % (args.game, len(log)))
+            if args.ply is not None:
+                try:
+                    print(log.position(args.game, args.ply).fen())
+                except IndexError as e:
+                    parser.error(str(e))
+            else:
+                write_pgn(sys.stdout, log[args.game])
+        elif args.pgn:
+            out = sys.stdout if args.pgn == '-' else open(args.pgn, 'w')
+            try:
+                for record in log:
+                    write_pgn(out, record)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            if out is not sys.stdout:
+                print('%d games exported to %s' % (len(log), args.pgn))
+        else:
+            for index, record in enumerate(log):
+                print(describe(index, record))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
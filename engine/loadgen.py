@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import deque
+
+from .board import GameState, all_legal_moves, move_to_uci, parse_uci_move
+from .server import DEFAULT_PORT, percentiles
+
+class LoadStats:
+    def __init__(self):
+        self.games = 0
+        self.finished = 0
+        self.moves = 0
+        self.replies = 0
+        self.errors = 0
+        self.drops = 0
+        self.latencies = []
+
+    def report(self, elapsed):
+        latency = percentiles(self.latencies)
+        return '\n'.join([
+            '%d games started, %d finished, %d client moves, %d engine replies in %.1fs' % (
+                self.games, self.finished, self.moves, self.replies, elapsed),
+            '%.1f moves/s, %d errors, %d dropped connections' % (
+                (self.moves + self.replies) / elapsed, self.errors, self.drops),
+            'reply latency p50 %s  p90 %s  p99 %s' % tuple(
+                '-' if latency[p] is None else '%.1f ms' % (latency[p] * 1000) for p in ('p50', 'p90', 'p99')),
+        ])
+
+class Connection:
+    """One TCP connection carrying several games. A reader task routes
+    replies to the game they belong to; started events, and errors without
+    a game, answer the "new" requests in the order they were sent."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.games = {}
+        self.starting = deque()
+        self.closed = False
+        self.task = asyncio.ensure_future(self.route())
+
+    @classmethod
+    async def open(cls, host, port):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def route(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                game = message.get('game')
+                if message['event'] == 'started' or message['event'] == 'error' and game is None:
+                    if self.starting:
+                        self.starting.popleft().set_result(message)
+                elif game in self.games:
+                    self.games[game].put_nowait(message)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.closed = True
+            for waiter in self.starting:
+                if not waiter.done():
+                    waiter.set_exception(ConnectionError('connection closed'))
+            for queue in self.games.values():
+                queue.put_nowait(None)
+
+    def send(self, request):
+        self.writer.write(json.dumps(request).encode() + b'\n')
+
+    async def new_game(self, engine, movetime):
+        if self.closed:
+            raise ConnectionError('connection closed')
+        waiter = asyncio.get_running_loop().create_future()
+        self.starting.append(waiter)
+        self.send({'op': 'new', 'engine': engine, 'movetime': movetime})
+        message = await waiter
+        if message['event'] == 'error':
+            raise RuntimeError(message['error'])
+        self.games[message['game']] = asyncio.Queue()
+        return message['game']
+
+    def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+async def play_game(conn, rng, deadline, movetime, max_plies, drop_rate, stats):
+    # Plays random legal moves against the engine. Returns False if the
+    # connection was dropped on purpose or lost.
+    engine = rng.choice(('white', 'black'))
+    game = await conn.new_game(engine, movetime)
+    stats.games += 1
+    queue = conn.games[game]
+    state = GameState()
+    sent = None
+    try:
+        for _ in range(max_plies):
+            if time.perf_counter() >= deadline:
+                break
+            if state.white_turn != (engine == 'white'):
+                move = rng.choice(all_legal_moves(state))
+                conn.send({'op': 'move', 'game': game, 'move': move_to_uci(move)})
+                stats.moves += 1
+                sent = time.perf_counter()
+                if rng.random() < drop_rate:
+                    stats.drops += 1
+                    return False
+            message = await queue.get()
+            if message is None:
+                return False
+            if message['event'] == 'error':
+                stats.errors += 1
+                break
+            if message['event'] == 'over':
+                stats.finished += 1
+                return True
+            state.push(parse_uci_move(state, message['move']))
+            if message['by'] == 'engine':
+                stats.replies += 1
+                if sent is not None:
+                    stats.latencies.append(time.perf_counter() - sent)
+                # The reply may also end the game.
+                if not all_legal_moves(state):
+                    message = await queue.get()
+                    stats.finished += message is not None and message['event'] == 'over'
+                    return message is not None
+        conn.send({'op': 'close', 'game': game})
+        return True
+    finally:
+        conn.games.pop(game, None)
+
+async def run_client(host, port, games, rng, deadline, movetime, max_plies, drop_rate, stats):
+    # Keeps games running on one connection until the deadline. When a game
+    # drops the connection, every game on it is abandoned, which makes the
+    # server cancel their searches, and the client reconnects.
+    async def play_games(conn):
+        try:
+            while time.perf_counter() < deadline:
+                if not await play_game(conn, rng, deadline, movetime, max_plies, drop_rate, stats):
+                    break
+        except ConnectionError:
+            pass
+        except RuntimeError:
+            stats.errors += 1
+        conn.close()
+
+    while time.perf_counter() < deadline:
+        try:
+            conn = await Connection.open(host, port)
+        except OSError:
+            stats.errors += 1
+            await asyncio.sleep(0.1)
+            continue
+        await asyncio.gather(*(play_games(conn) for _ in range(games)))
+
+async def fetch_metrics(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"op": "metrics"}\n')
+    try:
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+
+async def run_load(host, port, clients, games, duration, movetime, max_plies, drop_rate, seed):
+    stats = LoadStats()
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(run_client(host, port, games, random.Random(seed * 1000003 + i), deadline, movetime,
+                                      max_plies, drop_rate, stats) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    return stats, elapsed, await fetch_metrics(host, port)
+
+def main():
+    parser = argparse.ArgumentParser(description='Play many random-move games against engine.server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--clients', type=int, default=50, help='connections (default 50)')
+    parser.add_argument('--games', type=int, default=4, help='concurrent games per connection (default 4)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run (default 10)')
+    parser.add_argument('--movetime', type=float, default=0.05, help='engine budget per move (default 0.05)')
+    parser.add_argument('--max-plies', type=int, default=60, help='close a game after this many plies')
+    parser.add_argument('--drop', type=float, default=0.0,
+                        help='chance of dropping the connection after each move, to exercise cancellation')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    stats, elapsed, metrics = asyncio.run(run_load(
+        args.host, args.port, args.clients, args.games, args.duration, args.movetime, args.max_plies,
+        args.drop, args.seed))
+    print(stats.report(elapsed))
+    print('server: ' + json.dumps(metrics))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+from .batch import SEARCH_FEATURES, parse_position
+from .board import all_legal_moves, is_in_check, move_to_uci, parse_uci_move, popcount
+from .gamelog import GameLogWriter, GameRecord
+from .search import MAX_PLY, SearchContext, TranspositionTable, iterative_deepening
+
+DEFAULT_DEPTH = 3
+DEFAULT_OPENING_PLIES = 8
+DEFAULT_MAX_PLIES = 200
+DEFAULT_OPENINGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'openings.txt')
+RESULT_SCORES = {'1-0': 1.0, '1/2-1/2': 0.5, '0-1': 0.0}
+
+def parse_engine(spec):
+    """Parse an engine description such as "depth=4,no-lmr,name=base" into
+    a dict. Keys are name, depth, movetime, nodes and hash; "no-<feature>"
+    switches off one of the SEARCH_FEATURES."""
+    engine = {'name': spec, 'depth': None, 'movetime': None, 'nodes': None, 'hash': 16, 'features': {}}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        if item.startswith('no-'):
+            feature = item[3:].replace('-', '_')
+            if feature not in SEARCH_FEATURES:
+                raise ValueError('unknown feature: ' + item[3:])
+            engine['features'][feature] = False
+            continue
+        key, sep, value = item.partition('=')
+        if not sep or key not in ('name', 'depth', 'movetime', 'nodes', 'hash'):
+            raise ValueError('invalid engine option: ' + item)
+        engine[key] = value if key == 'name' else float(value) if key == 'movetime' else int(value)
+    if not (engine['depth'] or engine['movetime'] or engine['nodes']):
+        engine['depth'] = DEFAULT_DEPTH
+    return engine
+
+def read_openings(f, plies):
+    # Opening lines are cut to the first plies moves; lines that become the
+    # same opening are only played once.
+    openings = []
+    seen = set()
+    for line in f:
+        text = line.strip()
+        if not text or text.startswith('#'):
+            continue
+        tokens = text.split()
+        if 'moves' in tokens:
+            split = tokens.index('moves') + 1
+            text = ' '.join(tokens[:split + plies])
+        elif not (tokens[0] in ('fen', 'startpos') or '/' in tokens[0]):
+            text = ' '.join(tokens[:plies])
+        if text not in seen:
+            seen.add(text)
+            openings.append(text)
+    return openings
+
+def insufficient_material(state):
+    pieces = state.pieces
+    heavy = pieces['P'] | pieces['p'] | pieces['R'] | pieces['r'] | pieces['Q'] | pieces['q']
+    return not heavy and popcount(state.occupancy[0] | state.occupancy[1]) <= 3
+
+def play_game(game, opening, white, black, max_plies=DEFAULT_MAX_PLIES):
+    """Play one game from the opening between two engine dicts and return
+    its record. Games end by checkmate or stalemate, or are adjudicated
+    drawn on threefold repetition, insufficient material or after
+    max_plies moves."""
+    state = parse_position(opening)
+    contexts = {}
+    for color, engine in (('white', white), ('black', black)):
+        ctx = SearchContext(TranspositionTable(engine['hash']))
+        for feature, enabled in engine['features'].items():
+            setattr(ctx, 'use_' + feature, enabled)
+        contexts[color] = ctx
+    stats = {color: {'moves': 0, 'time': 0.0, 'nodes': 0, 'depth': 0} for color in contexts}
+    seen = {state.zobrist: 1}
+    moves = []
+    result = reason = None
+    while result is None:
+        if not all_legal_moves(state):
+            if is_in_check(state, state.white_turn):
+                result, reason = ('0-1' if state.white_turn else '1-0'), 'checkmate'
+            else:
+                result, reason = '1/2-1/2', 'stalemate'
+            break
+        if seen[state.zobrist] >= 3:
+            result, reason = '1/2-1/2', 'repetition'
+        elif insufficient_material(state):
+            result, reason = '1/2-1/2', 'insufficient material'
+        elif len(moves) >= max_plies:
+            result, reason = '1/2-1/2', 'move limit'
+        if result:
+            break
+        color = 'white' if state.white_turn else 'black'
+        engine, ctx = white if state.white_turn else black, contexts[color]
+        start = time.perf_counter()
+        _, move = iterative_deepening(state, engine['movetime'], engine['depth'] or MAX_PLY, engine['nodes'], ctx)
+        player = stats[color]
+        player['moves'] += 1
+        player['time'] += time.perf_counter() - start
+        player['nodes'] += ctx.nodes
+        player['depth'] += ctx.completed_depth
+        moves.append(move_to_uci(move))
+        state.push(move)
+        seen[state.zobrist] = seen.get(state.zobrist, 0) + 1
+    return {'game': game, 'opening': opening, 'white': white['name'], 'black': black['name'],
+            'result': result, 'reason': reason, 'plies': len(moves), 'moves': moves, 'stats': stats}
+
+def game_record(record):
+    """The game of a match record as a GameRecord starting from its
+    opening position."""
+    state = parse_position(record['opening'])
+    game = GameRecord(state, {'Event': 'Engine match', 'Date': time.strftime('%Y.%m.%d'),
+                              'Round': str(record['game'] + 1), 'White': record['white'],
+                              'Black': record['black'], 'Opening': record['opening']})
+    for text in record['moves']:
+        move = parse_uci_move(state, text)
+        state.push(move)
+        game.push(move)
+    game.finish(record['result'], record['reason'])
+    return game
+
+class MatchScore:
+    """Running result of engine a against engine b, which must have
+    different names."""
+
+    def __init__(self, a, b):
+        self.a, self.b = a, b
+        self.wins = self.draws = self.losses = 0
+        self.reasons = {}
+        self.totals = {a: [0, 0.0, 0, 0], b: [0, 0.0, 0, 0]}
+
+    def add(self, record):
+        score = RESULT_SCORES[record['result']]
+        if record['black'] == self.a:
+            score = 1.0 - score
+        if score == 1.0:
+            self.wins += 1
+        elif score == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        self.reasons[record['reason']] = self.reasons.get(record['reason'], 0) + 1
+        for color, player in record['stats'].items():
+            total = self.totals[record[color]]
+            total[0] += player['moves']
+            total[1] += player['time']
+            total[2] += player['nodes']
+            total[3] += player['depth']
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def interval(self, z=1.96):
+        # Score fraction for engine a with a Wilson score interval, using the
+        # per-game variance of win/draw/loss outcomes in place of p(1 - p).
+        # The z^2 terms keep the interval wide when few games have been
+        # played or every game had the same result.
+        n = self.games
+        if not n:
+            return 0.5, 0.0, 1.0
+        p = (self.wins + self.draws / 2) / n
+        variance = (self.wins * (1 - p) ** 2 + self.draws * (0.5 - p) ** 2 + self.losses * p ** 2) / n
+        z2 = z * z
+        center = (p + z2 / (2 * n)) / (1 + z2 / n)
+        margin = z * math.sqrt(variance / n + z2 / (4 * n * n)) / (1 + z2 / n)
+        return p, max(0.0, center - margin), min(1.0, center + margin)
+
+    def report(self):
+        p, low, high = self.interval()
+        lines = ['%s vs %s: +%d =%d -%d in %d games' % (self.a, self.b, self.wins, self.draws, self.losses,
+                                                        self.games),
+                 'score %.1f%% (95%% CI %.1f%% to %.1f%%), Elo %s (%s to %s)' % (
+                     p * 100, low * 100, high * 100, format_elo(p), format_elo(low), format_elo(high)),
+                 'endings: ' + ', '.join('%s %d' % item for item in sorted(self.reasons.items()))]
+        width = max(len(name) for name in self.totals)
+        for name, (moves, seconds, nodes, depth) in self.totals.items():
+            if moves:
+                lines.append('%-*s %6d moves  %.3fs/move  %8.0f nodes/move  depth %.1f' % (
+                    width, name, moves, seconds / moves, nodes / moves, depth / moves))
+        return '\n'.join(lines)
+
+def elo(p):
+    if p <= 0.0:
+        return -math.inf
+    if p >= 1.0:
+        return math.inf
+    return -400 * math.log10(1 / p - 1)
+
+def format_elo(p):
+    value = elo(p)
+    return '%+.0f' % (value + 0.0) if math.isfinite(value) else ('+inf' if value > 0 else '-inf')
+
+def schedule(openings, games):
+    # Each opening is played twice with colours reversed, so neither engine
+    # gets the better side of an opening more often.
+    for game in range(games):
+        yield game, openings[game // 2 % len(openings)], game % 2 == 1
+
+def run_match(a, b, openings, out, games, workers=None, max_plies=DEFAULT_MAX_PLIES, progress=None, log=None):
+    from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    workers = workers or os.cpu_count() or 1
+    score = MatchScore(a['name'], b['name'])
+
+    def drain(pending, return_when):
+        finished, pending = wait(pending, return_when=return_when)
+        for future in finished:
+            record = future.result()
+            score.add(record)
+            out.write(json.dumps(record) + '\n')
+            if log:
+                log.write_game(game_record(record))
+            if progress:
+                progress(record, score)
+        out.flush()
+        return pending
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        for game, opening, swapped in schedule(openings, games):
+            if len(pending) >= workers * 2:
+                pending = drain(pending, FIRST_COMPLETED)
+            white, black = (b, a) if swapped else (a, b)
+            pending.add(executor.submit(play_game, game, opening, white, black, max_plies))
+        if pending:
+            drain(pending, ALL_COMPLETED)
+    return score
+
+def main():
+    parser = argparse.ArgumentParser(description='Play engine-vs-engine games between two search configurations.')
+    parser.add_argument('engines', nargs=2, metavar='ENGINE',
+                        help='engine settings, e.g. "depth=4" or "movetime=0.1,no-lmr,name=nolmr"; keys: '
+                             'name, depth, movetime, nodes, hash, no-<feature> with features ' +
+                             ', '.join(f.replace('_', '-') for f in SEARCH_FEATURES))
+    parser.add_argument('-n', '--games', type=int, default=20, help='number of games (default 20)')
+    parser.add_argument('-o', '--output', help='JSONL file for the game records (default: standard output)')
+    parser.add_argument('--openings', default=DEFAULT_OPENINGS,
+                        help='file of openings: UCI move lists, FENs or "startpos|fen ... moves ..." lines')
+    parser.add_argument('--opening-plies', type=int, default=DEFAULT_OPENING_PLIES,
+                        help='cut move-list openings to this many plies (default %d)' % DEFAULT_OPENING_PLIES)
+    parser.add_argument('--max-plies', type=int, default=DEFAULT_MAX_PLIES,
+                        help='adjudicate a draw after this many plies (default %d)' % DEFAULT_MAX_PLIES)
+    parser.add_argument('--workers', type=int, help='worker processes (default: CPU count)')
+    parser.add_argument('--log', help='also append the games to this game log')
+    args = parser.parse_args()
+
+    try:
+        a, b = (parse_engine(spec) for spec in args.engines)
+    except ValueError as e:
+        parser.error(str(e))
+    if a['name'] == b['name']:
+        a['name'], b['name'] = a['name'] + ' (1)', b['name'] + ' (2)'
+    with open(args.openings) as f:
+        openings = read_openings(f, args.opening_plies)
+    if not openings:
+        parser.error('no openings in ' + args.openings)
+
+    def progress(record, score):
+        print('game %d: %s - %s %s (%s, %d plies)  +%d =%d -%d' % (
+            record['game'], record['white'], record['black'], record['result'], record['reason'],
+            record['plies'], score.wins, score.draws, score.losses), file=sys.stderr)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    log = GameLogWriter(args.log) if args.log else None
+    start = time.perf_counter()
+    try:
+        score = run_match(a, b, openings, out, args.games, args.workers, args.max_plies, progress, log)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if log:
+            log.close()
+    print(score.report(), file=sys.stderr)
+    print('%d games in %.1fs' % (score.games, time.perf_counter() - start), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import re
+
+from .board import (BACK_RANKS, PROMOTE_QUEEN, PROMOTION_PIECES, START_FEN, GameState, all_legal_moves,
+                    is_in_check, square_name)
+from .gamelog import GameRecord
+
+SEVEN_TAGS = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+TAG_LINE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+COMMENT = re.compile(r'\{[^}]*\}|;[^\n]*')
+TOKEN = re.compile(r'[()]|[^\s()]+')
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+LINE_WIDTH = 79
+
+def _san(state, move, moves):
+    frm, to = move >> 6 & 63, move & 63
+    squares = state.squares
+    piece = squares[frm]
+    kind = piece.upper()
+    if kind == 'K' and (to - frm == 2 or frm - to == 2):
+        return 'O-O' if to > frm else 'O-O-O'
+    if kind == 'P':
+        san = square_name(frm)[0] + 'x' if (frm ^ to) & 7 else ''
+        san += square_name(to)
+        if 1 << to & BACK_RANKS:
+            san += '=' + PROMOTION_PIECES[move >> 12 or PROMOTE_QUEEN].upper()
+        return san
+    san = kind
+    others = [m >> 6 & 63 for m in moves if m & 63 == to and m >> 6 & 63 != frm and squares[m >> 6 & 63] == piece]
+    if others:
+        if all(sq & 7 != frm & 7 for sq in others):
+            san += square_name(frm)[0]
+        elif all(sq >> 3 != frm >> 3 for sq in others):
+            san += square_name(frm)[1]
+        else:
+            san += square_name(frm)
+    if squares[to] != '.':
+        san += 'x'
+    return san + square_name(to)
+
+def move_to_san(state, move, moves=None):
+    """Standard algebraic notation for a legal move, with + or #."""
+    san = _san(state, move, all_legal_moves(state) if moves is None else moves)
+    state.push(move)
+    if is_in_check(state, state.white_turn):
+        san += '+' if all_legal_moves(state) else '#'
+    state.pop()
+    return san
+
+def parse_san(state, text):
+    san = text.rstrip('+#!?')
+    if san in ('0-0', '0-0-0'):
+        san = san.replace('0', 'O')
+    if san[-1:] in 'NBRQ' and san[-2:-1].isdigit():
+        san = san[:-1] + '=' + san[-1]
+    if '=' in san and not san.endswith('=Q'):
+        raise ValueError('under-promotion is not supported: ' + text)
+    moves = all_legal_moves(state)
+    for move in moves:
+        if _san(state, move, moves) == san:
+            return move
+    raise ValueError('illegal move: ' + text)
+
+def write_pgn(f, record):
+    tags = dict(record.tags)
+    tags['Result'] = record.result or '*'
+    start = record.position(0)
+    fen = start.fen()
+    if fen != START_FEN:
+        tags['SetUp'], tags['FEN'] = '1', fen
+    for name in SEVEN_TAGS:
+        f.write('[%s "%s"]\n' % (name, str(tags.get(name, '?')).replace('\\', '\\\\').replace('"', '\\"')))
+    for name, value in tags.items():
+        if name not in SEVEN_TAGS:
+            f.write('[%s "%s"]\n' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')))
+    f.write('\n')
+
+    words = []
+    offset = not start.white_turn
+    for ply, (state, move) in enumerate(record.replay()):
+        if state.white_turn:
+            words.append('%d.' % ((ply + offset) // 2 + 1))
+        elif not ply:
+            words.append('1...')
+        words.append(move_to_san(state, move))
+    if record.reason:
+        words.append('{%s}' % record.reason)
+    words.append(tags['Result'])
+    line = ''
+    for word in words:
+        if line and len(line) + 1 + len(word) > LINE_WIDTH:
+            f.write(line + '\n')
+            line = word
+        else:
+            line = line + ' ' + word if line else word
+    f.write(line + '\n\n')
+
+def _parse_game(tags, movetext):
+    fen = tags.get('FEN')
+    state = GameState.from_fen(fen) if fen else GameState()
+    record = GameRecord(state.copy(), {name: value for name, value in tags.items()
+                                       if name not in ('Result', 'SetUp', 'FEN')})
+    depth = 0
+    for token in TOKEN.findall(COMMENT.sub(' ', movetext)):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth or token.startswith('$'):
+            continue
+        elif token in RESULTS:
+            record.result = token
+        else:
+            token = MOVE_NUMBER.sub('', token)
+            if token:
+                move = parse_san(state, token)
+                state.push(move)
+                record.push(move)
+    if record.result is None and tags.get('Result') in RESULTS:
+        record.result = tags['Result']
+    if record.result == '*':
+        record.result = None
+    return record
+
+def read_pgn(f):
+    """Yield each game of a PGN file as a GameRecord. Comments, variations
+    and annotation glyphs are skipped; a move that is illegal or promotes
+    to anything but a queen raises ValueError."""
+    tags = {}
+    movetext = []
+    for line in f:
+        stripped = line.strip()
+        if stripped.startswith('%'):
+            continue
+        match = TAG_LINE.match(stripped)
+        if match:
+            if movetext:
+                yield _parse_game(tags, ' '.join(movetext))
+                tags, movetext = {}, []
+            tags[match.group(1)] = re.sub(r'\\(.)', r'\1', match.group(2))
+        elif stripped:
+            movetext.append(line)
+    if tags or movetext:
+        yield _parse_game(tags, ' '.join(movetext))
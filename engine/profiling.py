@@ -0,0 +1,79 @@
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+
+# The move generator entry points whose cost is summarised after a game.
+HOT_FUNCTIONS = ('all_legal_moves', 'is_attacked', 'make_move')
+
+class GameProfiler:
+    """cProfile for the length of a game. save() writes the raw profile to
+    path, which pstats and snakeviz can read, and returns call counts and
+    times for HOT_FUNCTIONS. It can be called repeatedly; each call writes
+    everything recorded so far."""
+
+    def __init__(self, path):
+        self.path = path
+        self.profile = cProfile.Profile()
+        self.enabled = False
+
+    def enable(self):
+        self.profile.enable()
+        self.enabled = True
+
+    def disable(self):
+        self.profile.disable()
+        self.enabled = False
+
+    def save(self):
+        self.profile.disable()
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.profile.dump_stats(self.path)
+            return hot_functions(pstats.Stats(self.profile))
+        finally:
+            if self.enabled:
+                self.profile.enable()
+
+def hot_functions(stats, names=HOT_FUNCTIONS):
+    """{name: (calls, own seconds, cumulative seconds)} for the engine
+    functions in names, taken from a pstats.Stats."""
+    totals = {}
+    for (filename, _, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        if function in names and os.path.basename(os.path.dirname(filename)) == 'engine':
+            old = totals.get(function, (0, 0.0, 0.0))
+            totals[function] = (old[0] + calls, old[1] + own, old[2] + cumulative)
+    return totals
+
+def load_hot_functions(path, names=HOT_FUNCTIONS):
+    return hot_functions(pstats.Stats(path), names)
+
+def profile_path(directory, game_id, role):
+    return os.path.join(directory, 'game-%s-%s.prof' % (game_id, role))
+
+def format_hot_functions(totals):
+    lines = ['%-16s %10s %10s %10s' % ('function', 'calls', 'own s', 'cum s')]
+    for name in sorted(totals, key=lambda n: -totals[n][2]):
+        calls, own, cumulative = totals[name]
+        lines.append('%-16s %10d %10.3f %10.3f' % (name, calls, own, cumulative))
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarise a profile written by a game.')
+    parser.add_argument('profiles', nargs='+', help='.prof files, e.g. from CHESS_PROFILE')
+    parser.add_argument('--top', type=int, default=0, help='also print the N most expensive functions')
+    args = parser.parse_args()
+
+    for path in args.profiles:
+        stats = pstats.Stats(path)
+        print(path)
+        print(format_hot_functions(hot_functions(stats)))
+        if args.top:
+            stats.sort_stats('cumulative').print_stats(args.top)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
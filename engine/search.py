@@ -0,0 +1,780 @@
+import os
+import time
+from array import array
+
+from .board import (ALL_SQUARES, BACK_RANKS, PROMOTION_MOVE, GameState, MoveCache, all_legal_moves, attackers_to,
+                    check_info, eval_board, generate_moves, is_in_check, legal_targets, popcount, variation_to_uci)
+from .tablebase import MAX_PIECES as TABLEBASE_PIECES, probe as probe_tablebase
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+class TranspositionTable:
+    ENTRY_BYTES = 16
+
+    def __init__(self, size_mb=16):
+        entries = 1
+        while entries * 2 * self.ENTRY_BYTES <= size_mb * 1024 * 1024:
+            entries *= 2
+        self.size = entries
+        self.mask = entries - 1
+        self.keys = array('Q', bytes(8 * entries))
+        self.scores = array('i', bytes(4 * entries))
+        self.moves = array('H', bytes(2 * entries))
+        self.depths = array('B', bytes(entries))
+        self.flags = array('B', bytes(entries))
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        self.age = (self.age + 1) & 63
+
+    def probe(self, key):
+        i = key & self.mask
+        if self.keys[i] != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.depths[i], self.scores[i], self.flags[i] & 3, self.moves[i]
+
+    def move(self, key):
+        # Stored move without touching the hit counters, for reading back the
+        # principal variation.
+        i = key & self.mask
+        return self.moves[i] if self.keys[i] == key else 0
+
+    def store(self, key, depth, score, bound, move):
+        i = key & self.mask
+        old_key = self.keys[i]
+        if old_key == key:
+            if not move:
+                move = self.moves[i]
+        elif old_key:
+            if self.flags[i] >> 2 == self.age and self.depths[i] > depth:
+                return
+            self.overwrites += 1
+        self.stores += 1
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.scores[i] = score
+        self.flags[i] = self.age << 2 | bound
+        self.moves[i] = move
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.size))
+        self.age = 0
+
+    def stats(self):
+        used = sum(1 for k in self.keys[:1000] if k) * 1000 // min(self.size, 1000)
+        return {'entries': self.size, 'hits': self.hits, 'misses': self.misses,
+                'stores': self.stores, 'overwrites': self.overwrites, 'permille_used': used}
+
+PONDER_TIME_LIMIT = 30.0
+
+INF = 999999
+MATE_SCORE = 100000
+MAX_PLY = 64
+# Tablebase mates can be further away than MAX_PLY, so leave room for them.
+MATE_BOUND = MATE_SCORE - 1000
+SEE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 20000,
+              'p': 100, 'n': 320, 'b': 330, 'r': 500, 'q': 900, 'k': 20000}
+NULL_MOVE_REDUCTION = 2
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
+MOVE_ORDER_VALUES = {'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 100,
+                     'p': 1, 'n': 3, 'b': 3, 'r': 5, 'q': 9, 'k': 100}
+
+class SearchAborted(Exception):
+    pass
+
+class SearchContext:
+    def __init__(self, tt=None):
+        self.tt = tt
+        self.move_cache = MoveCache()
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * 4096
+        self.nodes = 0
+        self.leaf_evals = 0
+        self.movegen_calls = 0
+        self.deadline = None
+        self.node_limit = None
+        self.abortable = False
+        self.root_ply = 0
+        self.root_best = None
+        self.completed_depth = 0
+        self.stop_event = None
+        self.use_tablebases = True
+        self.use_quiescence = True
+        self.use_see = True
+        self.use_null_move = True
+        self.use_lmr = True
+        self.use_staged_moves = True
+        self.tablebase_hits = 0
+        self.qnodes = 0
+        self.see_pruned = 0
+        self.null_cutoffs = 0
+        self.lmr_reductions = 0
+        self.lmr_researches = 0
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.moves_generated = 0
+        self.moves_searched = 0
+        self.search_stats = None
+
+    def start(self, state, time_limit=None, node_limit=None):
+        self.nodes = 0
+        self.leaf_evals = 0
+        self.movegen_calls = 0
+        self.deadline = time.perf_counter() + time_limit if time_limit else None
+        self.node_limit = node_limit
+        self.abortable = False
+        self.root_ply = len(state.undo_stack)
+        self.root_best = None
+        self.completed_depth = 0
+        self.tablebase_hits = 0
+        self.qnodes = 0
+        self.see_pruned = 0
+        self.null_cutoffs = 0
+        self.lmr_reductions = 0
+        self.lmr_researches = 0
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.moves_generated = 0
+        self.moves_searched = 0
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [h >> 1 for h in self.history]
+        if self.tt is not None:
+            self.tt.new_search()
+
+    def check_limits(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchAborted()
+        if self.node_limit and self.nodes >= self.node_limit:
+            raise SearchAborted()
+        if self.deadline and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    def stats(self):
+        return {'nodes': self.nodes, 'qnodes': self.qnodes, 'leaf_evals': self.leaf_evals,
+                'movegen_calls': self.movegen_calls, 'see_pruned': self.see_pruned,
+                'null_cutoffs': self.null_cutoffs, 'lmr_reductions': self.lmr_reductions,
+                'lmr_researches': self.lmr_researches, 'tablebase_hits': self.tablebase_hits,
+                'beta_cutoffs': self.beta_cutoffs, 'first_move_cutoffs': self.first_move_cutoffs,
+                'moves_generated': self.moves_generated, 'moves_searched': self.moves_searched}
+
+    def record_cutoff(self, state, move, depth, ply):
+        if state.squares[move & 63] != '.':
+            return
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        self.history[move & 0xFFF] += depth * depth
+
+def score_to_tt(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+def order_moves(state, moves, hash_move, ctx, ply):
+    squares = state.squares
+    killers = ctx.killers[ply] if ply < MAX_PLY else (None, None)
+    history = ctx.history
+
+    def score(move):
+        if move == hash_move:
+            return 1 << 30
+        frm = move >> 6 & 63
+        to = move & 63
+        victim = squares[to]
+        if victim != '.':
+            return (1 << 28) + MOVE_ORDER_VALUES[victim] * 128 - MOVE_ORDER_VALUES[squares[frm]]
+        if move == killers[0] or move == killers[1]:
+            return 1 << 27
+        return history[move & 0xFFF]
+
+    moves.sort(key=score, reverse=True)
+    return moves
+
+def capture_order(squares, move):
+    # MVV-LVA: the most valuable victim first, then the cheapest attacker.
+    # En passant takes a pawn and a promotion gains a queen for a pawn.
+    victim = squares[move & 63]
+    gain = MOVE_ORDER_VALUES[victim] if victim != '.' else 1 if (move ^ move >> 6) & 7 else 0
+    if move >> 12:
+        gain += MOVE_ORDER_VALUES['Q'] - MOVE_ORDER_VALUES['P']
+    return gain * 128 - MOVE_ORDER_VALUES[squares[move >> 6 & 63]]
+
+def staged_moves(state, hash_move, ctx, ply, info):
+    """Yield the legal moves of a position stage by stage: the hash move,
+    captures and promotions that do not lose material (MVV-LVA), the
+    killers, quiet moves by history and finally losing captures. A stage is
+    generated only when the search asks for its first move, so a cutoff
+    skips the legality checks of the stages after it."""
+    white = state.white_turn
+    squares = state.squares
+    own = state.occupancy[white]
+    ep = state.ep_square
+    tactical = state.occupancy[not white]
+    pawn_tactical = tactical | BACK_RANKS | (1 << ep if ep else 0)
+    tried = []
+
+    if hash_move and own >> (hash_move >> 6 & 63) & 1 and legal_targets(
+            state, hash_move >> 6 & 63, info, 1 << (hash_move & 63)):
+        # Match the promotion flag generate_moves would give the move.
+        hash_move &= 0xFFF
+        if squares[hash_move >> 6 & 63] in 'Pp' and 1 << (hash_move & 63) & BACK_RANKS:
+            hash_move |= PROMOTION_MOVE
+        tried.append(hash_move)
+        ctx.moves_generated += 1
+        yield hash_move
+
+    captures = [move for move in generate_moves(state, info, tactical, pawn_tactical) if move not in tried]
+    ctx.moves_generated += len(captures)
+    losing = []
+    winning = []
+    for move in captures:
+        victim = squares[move & 63]
+        if (victim != '.' and MOVE_ORDER_VALUES[victim] < MOVE_ORDER_VALUES[squares[move >> 6 & 63]] and
+                static_exchange(state, move) < 0):
+            losing.append(move)
+        else:
+            winning.append(move)
+    winning.sort(key=lambda move: capture_order(squares, move), reverse=True)
+    yield from winning
+
+    if ply < MAX_PLY:
+        for killer in ctx.killers[ply]:
+            if killer is None or killer in tried:
+                continue
+            frm = killer >> 6 & 63
+            to_bit = 1 << (killer & 63)
+            if (own >> frm & 1 and not to_bit & (pawn_tactical if squares[frm] in 'Pp' else tactical) and
+                    legal_targets(state, frm, info, to_bit)):
+                tried.append(killer)
+                ctx.moves_generated += 1
+                yield killer
+
+    quiets = [move for move in generate_moves(state, info, ALL_SQUARES ^ tactical, ALL_SQUARES ^ pawn_tactical)
+              if move not in tried]
+    ctx.moves_generated += len(quiets)
+    history = ctx.history
+    quiets.sort(key=lambda move: history[move & 0xFFF], reverse=True)
+    yield from quiets
+
+    losing.sort(key=lambda move: capture_order(squares, move), reverse=True)
+    yield from losing
+
+def static_exchange(state, move):
+    # Material balance of the capture sequence on the target square when both
+    # sides always recapture with their least valuable attacker.
+    frm = move >> 6 & 63
+    to = move & 63
+    squares = state.squares
+    pieces = state.pieces
+    gains = [SEE_VALUES.get(squares[to], 0)]
+    value = SEE_VALUES[squares[frm]]
+    occ = (state.occupancy[0] | state.occupancy[1]) ^ (1 << frm)
+    white = not squares[frm].isupper()
+    while True:
+        attackers = attackers_to(state, to, white, occ) & occ
+        if not attackers:
+            break
+        for p in ('PNBRQK' if white else 'pnbrqk'):
+            bb = attackers & pieces[p]
+            if bb:
+                break
+        if p in 'Kk' and attackers_to(state, to, not white, occ) & occ:
+            break
+        gains.append(value - gains[-1])
+        value = SEE_VALUES[p]
+        occ ^= bb & -bb
+        white = not white
+    while len(gains) > 1:
+        last = gains.pop()
+        gains[-1] = -max(-gains[-1], last)
+    return gains[0]
+
+def quiescence(state, alpha, beta, maximizing, ctx):
+    ctx.nodes += 1
+    ctx.qnodes += 1
+    if ctx.abortable and not ctx.nodes & 1023:
+        ctx.check_limits()
+
+    ply = len(state.undo_stack) - ctx.root_ply
+    squares = state.squares
+    in_check = is_in_check(state, state.white_turn)
+    if in_check and ply < MAX_PLY:
+        moves = all_legal_moves(state)
+        ctx.movegen_calls += 1
+        ctx.moves_generated += len(moves)
+        if not moves:
+            return ply - MATE_SCORE if state.white_turn else MATE_SCORE - ply
+        best_eval = -INF if maximizing else INF
+    else:
+        best_eval = eval_board(state)
+        ctx.leaf_evals += 1
+        if ply >= MAX_PLY:
+            return best_eval
+        if maximizing:
+            if best_eval >= beta:
+                return best_eval
+            alpha = max(alpha, best_eval)
+        else:
+            if best_eval <= alpha:
+                return best_eval
+            beta = min(beta, best_eval)
+        moves = []
+        enemy = state.occupancy[not state.white_turn]
+        ep = state.ep_square
+        tactical = generate_moves(state, check_info(state), enemy, enemy | BACK_RANKS | (1 << ep if ep else 0))
+        ctx.moves_generated += len(tactical)
+        for move in tactical:
+            if squares[move & 63] != '.' and ctx.use_see and static_exchange(state, move) < 0:
+                ctx.see_pruned += 1
+                continue
+            moves.append(move)
+        ctx.movegen_calls += 1
+
+    order_moves(state, moves, None, ctx, ply)
+    for move in moves:
+        ctx.moves_searched += 1
+        state.push(move)
+        eval_score = quiescence(state, alpha, beta, not maximizing, ctx)
+        state.pop()
+        if maximizing:
+            if eval_score > best_eval:
+                best_eval = eval_score
+            alpha = max(alpha, eval_score)
+        else:
+            if eval_score < best_eval:
+                best_eval = eval_score
+            beta = min(beta, eval_score)
+        if beta <= alpha:
+            break
+    return best_eval
+
+def minimax(state, depth, alpha, beta, maximizing, ctx=None):
+    if ctx is None:
+        ctx = SearchContext()
+        ctx.start(state)
+    ctx.nodes += 1
+    if ctx.abortable and not ctx.nodes & 1023:
+        ctx.check_limits()
+
+    tt = ctx.tt
+    ply = len(state.undo_stack) - ctx.root_ply
+    if (ply and ctx.use_tablebases and
+            popcount(state.occupancy[0] | state.occupancy[1]) <= TABLEBASE_PIECES):
+        result = probe_tablebase(state)
+        if result is not None:
+            ctx.tablebase_hits += 1
+            outcome, plies = result
+            if not outcome:
+                return 0, None
+            score = MATE_SCORE - ply - plies
+            return (score if (outcome > 0) == state.white_turn else -score), None
+    hash_move = ctx.root_best if ply == 0 else None
+    if tt is not None and depth > 0:
+        entry = tt.probe(state.zobrist)
+        if entry:
+            tt_depth, tt_score, bound, tt_move = entry
+            tt_score = score_from_tt(tt_score, ply)
+            if tt_move:
+                hash_move = tt_move
+            if tt_depth >= depth:
+                if bound == EXACT:
+                    return tt_score, hash_move
+                if bound == LOWER_BOUND:
+                    alpha = max(alpha, tt_score)
+                else:
+                    beta = min(beta, tt_score)
+                if beta <= alpha:
+                    return tt_score, hash_move
+
+    if depth == 0 and ctx.use_quiescence:
+        return quiescence(state, alpha, beta, maximizing, ctx), None
+
+    in_check = is_in_check(state, state.white_turn)
+    if depth == 0 and not in_check:
+        ctx.leaf_evals += 1
+        return eval_board(state), None
+
+    if (ctx.use_null_move and depth >= NULL_MOVE_REDUCTION + 1 and ply and not in_check and
+            state.undo_stack[-1][0] is not None and abs(beta if maximizing else alpha) < MATE_BOUND and
+            state.occupancy[state.white_turn] & ~(state.pieces['P'] | state.pieces['p'] |
+                                                  state.pieces['K'] | state.pieces['k'])):
+        # Give the opponent a free move; if the position still fails high
+        # (low, for the minimizing side) a real move will too.
+        state.push_null()
+        if maximizing:
+            score, _ = minimax(state, depth - 1 - NULL_MOVE_REDUCTION, beta - 1, beta, False, ctx)
+        else:
+            score, _ = minimax(state, depth - 1 - NULL_MOVE_REDUCTION, alpha, alpha + 1, True, ctx)
+        state.pop()
+        if (score >= beta) if maximizing else (score <= alpha):
+            ctx.null_cutoffs += 1
+            return (beta if maximizing else alpha), None
+
+    ctx.movegen_calls += 1
+    if ply and depth and ctx.use_staged_moves:
+        moves = staged_moves(state, hash_move, ctx, ply, check_info(state))
+    else:
+        # Every iteration starts from the same root, so its moves come from
+        # the cache; order_moves sorts the fresh list all_moves returns.
+        moves = ctx.move_cache.all_moves(state) if ply == 0 else all_legal_moves(state)
+        ctx.moves_generated += len(moves)
+        if not moves:
+            if not in_check:
+                return 0, None
+            return (ply - MATE_SCORE if state.white_turn else MATE_SCORE - ply), None
+        if depth == 0:
+            ctx.leaf_evals += 1
+            return eval_board(state), None
+        order_moves(state, moves, hash_move, ctx, ply)
+    alpha_orig, beta_orig = alpha, beta
+    best_move = None
+    squares = state.squares
+    reduce = ctx.use_lmr and ply and depth >= LMR_MIN_DEPTH and not in_check
+    
+    if maximizing:
+        best_eval = -INF
+        for i, move in enumerate(moves):
+            ctx.moves_searched += 1
+            quiet = squares[move & 63] == '.' and squares[move >> 6 & 63] not in 'Pp'
+            state.push(move)
+            if reduce and i >= LMR_MIN_MOVES and quiet and not is_in_check(state, state.white_turn):
+                ctx.lmr_reductions += 1
+                eval_score, _ = minimax(state, depth - 2, alpha, alpha + 1, False, ctx)
+                if eval_score > alpha:
+                    ctx.lmr_researches += 1
+                    eval_score, _ = minimax(state, depth - 1, alpha, beta, False, ctx)
+            else:
+                eval_score, _ = minimax(state, depth - 1, alpha, beta, False, ctx)
+            state.pop()
+            if eval_score > best_eval:
+                best_eval = eval_score
+                best_move = move
+            alpha = max(alpha, eval_score)
+            if beta <= alpha:
+                ctx.beta_cutoffs += 1
+                ctx.first_move_cutoffs += not i
+                ctx.record_cutoff(state, move, depth, ply)
+                break
+    else:
+        best_eval = INF
+        for i, move in enumerate(moves):
+            ctx.moves_searched += 1
+            quiet = squares[move & 63] == '.' and squares[move >> 6 & 63] not in 'Pp'
+            state.push(move)
+            if reduce and i >= LMR_MIN_MOVES and quiet and not is_in_check(state, state.white_turn):
+                ctx.lmr_reductions += 1
+                eval_score, _ = minimax(state, depth - 2, beta - 1, beta, True, ctx)
+                if eval_score < beta:
+                    ctx.lmr_researches += 1
+                    eval_score, _ = minimax(state, depth - 1, alpha, beta, True, ctx)
+            else:
+                eval_score, _ = minimax(state, depth - 1, alpha, beta, True, ctx)
+            state.pop()
+            if eval_score < best_eval:
+                best_eval = eval_score
+                best_move = move
+            beta = min(beta, eval_score)
+            if beta <= alpha:
+                ctx.beta_cutoffs += 1
+                ctx.first_move_cutoffs += not i
+                ctx.record_cutoff(state, move, depth, ply)
+                break
+
+    if best_move is None:
+        # The staged moves ran out without a single legal move.
+        if not in_check:
+            return 0, None
+        return (ply - MATE_SCORE if state.white_turn else MATE_SCORE - ply), None
+
+    if tt is not None:
+        if best_eval <= alpha_orig:
+            bound = UPPER_BOUND
+        elif best_eval >= beta_orig:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        tt.store(state.zobrist, depth, score_to_tt(best_eval, ply), bound, best_move)
+    return best_eval, best_move
+
+def principal_variation(state, tt, move, max_length=MAX_PLY):
+    """The expected line of play starting with move, read back from the
+    transposition table until an entry is missing or the line repeats."""
+    pv = []
+    seen = set()
+    while move and len(pv) < max_length and state.zobrist not in seen and move in all_legal_moves(state):
+        seen.add(state.zobrist)
+        pv.append(move)
+        state.push(move)
+        code = tt.move(state.zobrist) if tt is not None else 0
+        move = code or None
+    for _ in pv:
+        state.pop()
+    return pv
+
+class SearchStats:
+    """What one iterative deepening search did. Counters cover the whole
+    search; depth_times holds (depth, seconds) for each completed iteration
+    and pv the principal variation of the last one in UCI notation."""
+
+    def __init__(self, state, ctx, score, move, depth_times, elapsed):
+        self.depth = ctx.completed_depth
+        self.score = score
+        self.best_move = move
+        self.pv = variation_to_uci(principal_variation(state, ctx.tt, move)) if move else []
+        self.depth_times = depth_times
+        self.elapsed = elapsed
+        self.nodes = ctx.nodes
+        self.leaf_evals = ctx.leaf_evals
+        self.beta_cutoffs = ctx.beta_cutoffs
+        self.first_move_cutoffs = ctx.first_move_cutoffs
+        self.movegen_calls = ctx.movegen_calls
+        self.moves_generated = ctx.moves_generated
+        self.moves_searched = ctx.moves_searched
+        self.counters = ctx.stats()
+
+    @property
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0
+
+    @property
+    def unsearched_rate(self):
+        # Share of the generated moves the search never played.
+        if not self.moves_generated:
+            return 0.0
+        return (self.moves_generated - self.moves_searched) / self.moves_generated
+
+    @property
+    def nps(self):
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {'depth': self.depth, 'score': self.score, 'pv': self.pv,
+                'depth_times': [[depth, round(seconds, 4)] for depth, seconds in self.depth_times],
+                'elapsed': round(self.elapsed, 4), **self.counters}
+
+    def summary(self):
+        return ['depth %d  %d nodes  %.2fs  %.0f nps' % (self.depth, self.nodes, self.elapsed, self.nps),
+                'cutoffs %d (%.0f%% first move)  movegen %d  evals %d' % (
+                    self.beta_cutoffs, self.first_move_cutoff_rate * 100, self.movegen_calls, self.leaf_evals),
+                'moves generated %d  searched %d  unsearched %.0f%%' % (
+                    self.moves_generated, self.moves_searched, self.unsearched_rate * 100),
+                'pv ' + ' '.join(self.pv)]
+
+def iterative_deepening(state, time_limit=None, max_depth=MAX_PLY, node_limit=None, ctx=None,
+                        on_iteration=None):
+    """Search one ply deeper each iteration until a limit is reached and
+    return (score, move). ctx.search_stats holds a SearchStats afterwards."""
+    if ctx is None:
+        ctx = SearchContext(TranspositionTable())
+    ctx.start(state, time_limit, node_limit)
+    started = time.perf_counter()
+    best_score, best_move = eval_board(state), None
+    if ctx.use_tablebases and probe_tablebase(state) is not None:
+        # Every reply is scored exactly by the tables, so one ply is enough.
+        max_depth = 1
+
+    depth_times = []
+    for depth in range(1, max_depth + 1):
+        ctx.abortable = depth > 1
+        iteration_started = time.perf_counter()
+        try:
+            score, move = minimax(state, depth, -INF, INF, state.white_turn, ctx)
+        except SearchAborted:
+            while len(state.undo_stack) > ctx.root_ply:
+                state.pop()
+            break
+        if move is None:
+            # No legal move at the root: keep the mate or stalemate score.
+            if depth == 1:
+                best_score = score
+            break
+        best_score, best_move = score, move
+        ctx.root_best = move
+        ctx.completed_depth = depth
+        depth_times.append((depth, time.perf_counter() - iteration_started))
+        if on_iteration is not None:
+            on_iteration(depth, score, move, ctx.nodes, time.perf_counter() - started)
+        if abs(score) > MATE_BOUND:
+            break
+        if time_limit and time.perf_counter() - started > time_limit / 2:
+            break
+
+    ctx.search_stats = SearchStats(state, ctx, best_score, best_move, depth_times, time.perf_counter() - started)
+    return best_score, best_move
+
+_worker_ctx = None
+_worker_bound = None
+
+def _init_search_worker(bound, tt_mb):
+    global _worker_ctx, _worker_bound
+    _worker_bound = bound
+    _worker_ctx = SearchContext(TranspositionTable(tt_mb))
+
+def _search_root_move(fen, move, depth):
+    state = GameState.from_fen(fen)
+    ctx = _worker_ctx
+    ctx.start(state)
+    maximizing = state.white_turn
+    bound = _worker_bound.value
+    state.push(move)
+    if maximizing:
+        score, _ = minimax(state, depth - 1, bound, INF, False, ctx)
+    else:
+        score, _ = minimax(state, depth - 1, -INF, bound, True, ctx)
+    # A score that beats the bound is exact; one that does not is only an
+    # upper (lower, for black) bound and may tie the move that set it.
+    exact = score > bound if maximizing else score < bound
+    with _worker_bound.get_lock():
+        if (score > _worker_bound.value) if maximizing else (score < _worker_bound.value):
+            _worker_bound.value = score
+    return move, score, ctx.nodes, exact
+
+class ParallelSearch:
+    def __init__(self, workers=None, tt_mb=16):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.workers = workers or os.cpu_count() or 1
+        self.bound = multiprocessing.Value('i', 0)
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_init_search_worker,
+                                            initargs=(self.bound, tt_mb))
+        self.nodes = 0
+
+    def search(self, state, depth):
+        moves = all_legal_moves(state)
+        if not moves or depth < 1:
+            return minimax(state, depth, -INF, INF, state.white_turn)
+
+        maximizing = state.white_turn
+        ctx = SearchContext()
+        ctx.start(state)
+        order_moves(state, moves, None, ctx, 0)
+        fen = state.fen()
+        self.bound.value = -INF if maximizing else INF
+
+        results = [self.executor.submit(_search_root_move, fen, moves[0], depth).result()]
+        futures = [self.executor.submit(_search_root_move, fen, move, depth) for move in moves[1:]]
+        results.extend(f.result() for f in futures)
+
+        self.nodes = sum(nodes for _, _, nodes, _ in results)
+        best_move, best_score, _, best_exact = results[0]
+        for move, score, _, exact in results[1:]:
+            # On a tie, a move that failed low against the bound loses to
+            # the move whose exact score set it.
+            if ((score > best_score) if maximizing else (score < best_score)) or (
+                    score == best_score and exact and not best_exact):
+                best_move, best_score, best_exact = move, score, exact
+        return best_score, best_move
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_ai_ctx = None
+_ai_profiler = None
+
+def _init_ai_worker(stop_event, tt_mb, profile):
+    global _ai_ctx, _ai_profiler
+    _ai_ctx = SearchContext(TranspositionTable(tt_mb))
+    _ai_ctx.stop_event = stop_event
+    if profile:
+        from .profiling import GameProfiler
+
+        _ai_profiler = GameProfiler(profile)
+        _ai_profiler.enable()
+
+def _ai_search(fen, time_limit):
+    score, move = iterative_deepening(GameState.from_fen(fen), time_limit, ctx=_ai_ctx)
+    if _ai_profiler is not None:
+        _ai_profiler.save()
+    return score, move, _ai_ctx.search_stats
+
+class AIWorker:
+    def __init__(self, tt_mb=16, ponder=True, profile=None):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        mp_context = multiprocessing.get_context('spawn')
+        self.stop_event = mp_context.Event()
+        self.executor = ProcessPoolExecutor(1, mp_context=mp_context, initializer=_init_ai_worker,
+                                            initargs=(self.stop_event, tt_mb, profile))
+        self.ponder_enabled = ponder
+        self.profile = profile
+        self.stats = None
+        self.future = None
+        self.pondering = None
+        self.position = None
+        self.started = None
+
+    @property
+    def thinking(self):
+        return self.future is not None
+
+    def start(self, state, time_limit):
+        self.stop_pondering()
+        self.position = state.zobrist
+        self.started = time.perf_counter()
+        self.future = self.executor.submit(_ai_search, state.fen(), time_limit)
+
+    def poll(self, state):
+        if self.future is None or not self.future.done():
+            return None
+        future, self.future = self.future, None
+        if state.zobrist != self.position:
+            return None
+        _, move, self.stats = future.result()
+        return move
+
+    def ponder(self, state):
+        if self.ponder_enabled and self.pondering is None:
+            self.pondering = self.executor.submit(_ai_search, state.fen(), PONDER_TIME_LIMIT)
+
+    def stop_pondering(self):
+        if self.pondering is None:
+            return
+        self.stop_event.set()
+        try:
+            self.pondering.result()
+        finally:
+            self.pondering = None
+            self.stop_event.clear()
+
+    def cancel(self):
+        # Abandons the search for the current move, e.g. after a takeback.
+        self.stop_pondering()
+        if self.future is None:
+            return
+        self.stop_event.set()
+        try:
+            self.future.result()
+        finally:
+            self.future = None
+            self.stop_event.clear()
+
+    def close(self):
+        self.stop_event.set()
+        # A profiled worker writes its profile after each search; let it finish.
+        self.executor.shutdown(wait=self.profile is not None, cancel_futures=True)
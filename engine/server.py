@@ -0,0 +1,495 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures.process import BrokenProcessPool
+
+from .board import GameState, all_legal_moves, is_in_check, move_to_uci, parse_uci_move
+from .book import DEFAULT_BOOK_PATH, load_book
+from .gamelog import GameLogWriter, GameRecord
+from .match import insufficient_material
+from .search import SearchContext, TranspositionTable, iterative_deepening
+
+DEFAULT_PORT = 8765
+DEFAULT_MOVETIME = 0.1
+MAX_MOVETIME = 5.0
+MIN_SEARCH_TIME = 0.01
+MAX_GAMES_PER_CLIENT = 256
+SEARCH_ATTEMPTS = 2
+MAX_WRITE_BUFFER = 1 << 20
+LATENCY_SAMPLES = 2000
+RATE_WINDOW = 10.0
+
+_server_ctx = None
+_server_book = None
+
+class _CancelFlag:
+    # Stands in for SearchContext.stop_event: the server cancels the search
+    # running in a slot by setting that slot's byte in a shared array.
+    def __init__(self, flags):
+        self.flags = flags
+        self.slot = 0
+
+    def is_set(self):
+        return self.flags[self.slot] != 0
+
+def _init_server_worker(flags, tt_mb, book_path):
+    global _server_ctx, _server_book
+    _server_ctx = SearchContext(TranspositionTable(tt_mb))
+    _server_ctx.stop_event = _CancelFlag(flags)
+    _server_book = load_book(book_path) if book_path else None
+
+def _serve_search(fen, time_limit, slot):
+    start = time.perf_counter()
+    state = GameState.from_fen(fen)
+    move = _server_book.choose(state) if _server_book else None
+    if move:
+        return move_to_uci(move), {'book': True, 'time': time.perf_counter() - start}
+    _server_ctx.stop_event.slot = slot
+    score, move = iterative_deepening(state, time_limit, ctx=_server_ctx)
+    return move_to_uci(move) if move else None, {
+        'score': score, 'depth': _server_ctx.completed_depth, 'nodes': _server_ctx.nodes,
+        'time': time.perf_counter() - start}
+
+def percentiles(values, points=(50, 90, 99)):
+    ordered = sorted(values)
+    if not ordered:
+        return {'p%d' % p: None for p in points}
+    return {'p%d' % p: ordered[min(len(ordered) - 1, len(ordered) * p // 100)] for p in points}
+
+class Job:
+    __slots__ = ('client', 'fen', 'budget', 'queued', 'future', 'slot')
+
+    def __init__(self, client, fen, budget, future):
+        self.client = client
+        self.fen = fen
+        self.budget = budget
+        self.queued = time.perf_counter()
+        self.future = future
+        self.slot = None
+
+class EngineService:
+    """A bounded pool of search processes shared by every game. Requests
+    wait in one queue per client and are dispatched round-robin across
+    clients, so a client with many games cannot starve the others. A
+    request's budget covers its time in the queue as well as the search.
+    Cancelling the awaiting task drops a queued request or stops its search
+    within a few thousand nodes. A pool broken by a dying worker is replaced
+    by a fresh one."""
+
+    def __init__(self, workers=1, tt_mb=16, book_path=DEFAULT_BOOK_PATH, metrics=None):
+        import multiprocessing
+
+        self.mp_context = multiprocessing.get_context('spawn')
+        self.flags = self.mp_context.Array('b', workers, lock=False)
+        self.initargs = (self.flags, tt_mb, book_path)
+        self.workers = workers
+        self.executor = self.new_pool()
+        self.free_slots = list(range(workers))
+        self.queues = OrderedDict()
+        self.metrics = metrics or Metrics()
+
+    def new_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        return ProcessPoolExecutor(self.workers, mp_context=self.mp_context, initializer=_init_server_worker,
+                                   initargs=self.initargs)
+
+    @property
+    def queue_depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    @property
+    def in_flight(self):
+        return self.workers - len(self.free_slots)
+
+    async def search(self, client, fen, budget):
+        """(uci move, info) for the position. Each game has at most one
+        request waiting, so MAX_GAMES_PER_CLIENT also bounds a client's
+        queue. Raises whatever the search raised, such as BrokenProcessPool
+        when its worker died."""
+        queue = self.queues.setdefault(client, deque())
+        job = Job(client, fen, budget, asyncio.get_running_loop().create_future())
+        queue.append(job)
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            self.metrics.cancelled += 1
+            if job.slot is not None:
+                self.flags[job.slot] = 1
+            else:
+                queue = self.queues.get(client)
+                if queue and job in queue:
+                    queue.remove(job)
+                    if not queue:
+                        del self.queues[client]
+            raise
+
+    def drop(self, client):
+        for job in self.queues.pop(client, ()):
+            job.future.cancel()
+
+    def _dispatch(self):
+        queues = self.queues
+        while self.free_slots and queues:
+            client, queue = next(iter(queues.items()))
+            queues.move_to_end(client)
+            job = queue.popleft()
+            if not queue:
+                del queues[client]
+            if job.future.done():
+                continue
+            waited = time.perf_counter() - job.queued
+            job.slot = self.free_slots.pop()
+            self.flags[job.slot] = 0
+            self.metrics.queue_waits.append(waited)
+            args = (_serve_search, job.fen, max(MIN_SEARCH_TIME, job.budget - waited), job.slot)
+            try:
+                future = self.executor.submit(*args)
+            except BrokenProcessPool:
+                self._restart(self.executor)
+                future = self.executor.submit(*args)
+            asyncio.wrap_future(future).add_done_callback(
+                lambda done, job=job, executor=self.executor: self._finished(job, done, executor))
+
+    def _restart(self, executor):
+        # Every search in flight on a broken pool fails; only the first
+        # failure replaces the pool.
+        if executor is self.executor:
+            self.metrics.restarts += 1
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.new_pool()
+
+    def _finished(self, job, done, executor):
+        self.free_slots.append(job.slot)
+        # A restart cancels searches the old pool had not started yet.
+        error = BrokenProcessPool('engine pool restarted') if done.cancelled() else done.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._restart(executor)
+        if not job.future.done():
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                move, info = done.result()
+                self.metrics.search_times.append(info['time'])
+                self.metrics.latencies.append(time.perf_counter() - job.queued)
+                job.future.set_result((move, info))
+        self._dispatch()
+
+    def close(self):
+        for client in list(self.queues):
+            self.drop(client)
+        for slot in range(self.workers):
+            self.flags[slot] = 1
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+class Metrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.search_times = deque(maxlen=LATENCY_SAMPLES)
+        self.queue_waits = deque(maxlen=LATENCY_SAMPLES)
+        self.recent_moves = deque()
+        self.connections = 0
+        self.games = 0
+        self.moves = 0
+        self.engine_moves = 0
+        self.finished = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.restarts = 0
+
+    def move_played(self, by_engine):
+        self.moves += 1
+        self.engine_moves += by_engine
+        self.recent_moves.append(time.perf_counter())
+        self.expire_moves()
+
+    def expire_moves(self):
+        now = time.perf_counter()
+        recent = self.recent_moves
+        while recent and recent[0] < now - RATE_WINDOW:
+            recent.popleft()
+        return now
+
+    def moves_per_second(self):
+        now = self.expire_moves()
+        return len(self.recent_moves) / min(RATE_WINDOW, max(now - self.started, 1e-9))
+
+    def snapshot(self, service, sessions):
+        return {
+            'uptime': time.perf_counter() - self.started, 'connections': self.connections,
+            'sessions': sessions, 'games': self.games, 'finished': self.finished, 'moves': self.moves,
+            'engine_moves': self.engine_moves, 'moves_per_second': self.moves_per_second(),
+            'queue_depth': service.queue_depth, 'in_flight': service.in_flight,
+            'cancelled': self.cancelled, 'errors': self.errors, 'engine_restarts': self.restarts,
+            'latency': percentiles(self.latencies), 'search_time': percentiles(self.search_times),
+            'queue_wait': percentiles(self.queue_waits),
+        }
+
+def prometheus(snapshot):
+    # Text exposition format, for scraping over HTTP.
+    lines = []
+    for name, value in snapshot.items():
+        if isinstance(value, dict):
+            for point, seconds in value.items():
+                if seconds is not None:
+                    quantile = int(point[1:]) / 100
+                    lines.append('chess_%s_seconds{quantile="%g"} %.6f' % (name, quantile, seconds))
+        else:
+            lines.append('chess_%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+class Session:
+    __slots__ = ('id', 'record', 'seen', 'engine_white', 'budget', 'task', 'over')
+
+    def __init__(self, game_id, state, engine_white, budget, tags):
+        self.id = game_id
+        self.record = GameRecord(state, tags)
+        self.record.state = state
+        self.seen = {state.zobrist: 1}
+        self.engine_white = engine_white
+        self.budget = budget
+        self.task = None
+        self.over = False
+
+    @property
+    def state(self):
+        return self.record.state
+
+    def engine_to_move(self):
+        return self.engine_white is not None and self.state.white_turn == self.engine_white
+
+    def outcome(self):
+        state = self.state
+        if not all_legal_moves(state):
+            if is_in_check(state, state.white_turn):
+                return ('0-1' if state.white_turn else '1-0'), 'checkmate'
+            return '1/2-1/2', 'stalemate'
+        if self.seen[state.zobrist] >= 3:
+            return '1/2-1/2', 'repetition'
+        if insufficient_material(state):
+            return '1/2-1/2', 'insufficient material'
+        return None
+
+class Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.games = {}
+
+    def send(self, message):
+        if self.writer.is_closing():
+            return
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            # The client is not reading its replies.
+            self.writer.close()
+            return
+        self.writer.write(json.dumps(message).encode() + b'\n')
+
+class GameServer:
+    """Hosts games over TCP, one JSON object per line in each direction.
+
+    Requests: {"op": "new", "engine": "white"|"black"|null, "movetime": s,
+    "fen": ...}, {"op": "move", "game": id, "move": "e2e4"},
+    {"op": "close", "game": id} and {"op": "metrics"}. Replies carry an
+    "event": started, move, over, closed, metrics or error. Every move is
+    checked against the legal moves of the game's GameState, and a game is
+    closed as soon as it is over."""
+
+    def __init__(self, service, log=None):
+        self.service = service
+        self.metrics = service.metrics
+        self.log = log
+        self.sessions = 0
+        self.next_id = 1
+
+    async def handle(self, reader, writer):
+        client = Client(writer)
+        self.metrics.connections += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    break
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('requests must be JSON objects')
+                    self.dispatch(client, request)
+                except (ValueError, KeyError, TypeError, OverflowError) as e:
+                    self.metrics.errors += 1
+                    error = 'missing field: %s' % e.args[0] if isinstance(e, KeyError) else str(e)
+                    game = request.get('game') if isinstance(request, dict) else None
+                    client.send({'event': 'error', 'game': game, 'error': error})
+        finally:
+            self.metrics.connections -= 1
+            for session in list(client.games.values()):
+                self.end(client, session)
+            self.service.drop(client)
+            writer.close()
+
+    def dispatch(self, client, request):
+        op = request['op']
+        if op == 'metrics':
+            client.send(dict(self.metrics.snapshot(self.service, self.sessions), event='metrics'))
+            return
+        if op == 'new':
+            self.start(client, request)
+            return
+        session = client.games.get(request.get('game'))
+        if session is None:
+            raise ValueError('no such game: %s' % request.get('game'))
+        if op == 'move':
+            self.play(client, session, request['move'])
+        elif op == 'close':
+            self.end(client, session)
+            client.send({'event': 'closed', 'game': session.id})
+        else:
+            raise ValueError('unknown op: %s' % op)
+
+    def start(self, client, request):
+        if len(client.games) >= MAX_GAMES_PER_CLIENT:
+            raise OverflowError('too many games')
+        engine = request.get('engine')
+        if engine not in ('white', 'black', None):
+            raise ValueError('engine must be white, black or null')
+        budget = min(float(request.get('movetime', DEFAULT_MOVETIME)), MAX_MOVETIME)
+        state = GameState.from_fen(request['fen']) if request.get('fen') else GameState()
+        tags = {'Event': 'Server game', 'Date': time.strftime('%Y.%m.%d'),
+                'White': 'Engine' if engine == 'white' else 'Client',
+                'Black': 'Engine' if engine == 'black' else 'Client'}
+        session = Session(self.next_id, state, None if engine is None else engine == 'white', budget, tags)
+        self.next_id += 1
+        client.games[session.id] = session
+        self.sessions += 1
+        self.metrics.games += 1
+        client.send({'event': 'started', 'game': session.id, 'fen': state.fen(), 'engine': engine})
+        self.advance(client, session)
+
+    def play(self, client, session, text):
+        if session.over:
+            raise ValueError('game %d is over' % session.id)
+        if session.engine_to_move():
+            raise ValueError('not your move')
+        self.apply(client, session, parse_uci_move(session.state, text), False)
+
+    def apply(self, client, session, move, by_engine, info=None):
+        session.record.push(move)
+        state = session.state
+        session.seen[state.zobrist] = session.seen.get(state.zobrist, 0) + 1
+        self.metrics.move_played(by_engine)
+        message = {'event': 'move', 'game': session.id, 'move': move_to_uci(move),
+                   'by': 'engine' if by_engine else 'client', 'fen': state.fen()}
+        if info:
+            message.update(info)
+        client.send(message)
+        self.advance(client, session)
+
+    def advance(self, client, session):
+        outcome = session.outcome()
+        if outcome:
+            session.over = True
+            session.record.finish(*outcome)
+            self.metrics.finished += 1
+            client.send({'event': 'over', 'game': session.id, 'result': outcome[0], 'reason': outcome[1]})
+            self.end(client, session)
+        elif session.engine_to_move():
+            session.task = asyncio.ensure_future(self.engine_move(client, session))
+
+    async def engine_move(self, client, session):
+        # A failed search is tried again, on a fresh pool if a worker died;
+        # a game the engine cannot move in is ended rather than left waiting.
+        error = 'no move found'
+        for _ in range(SEARCH_ATTEMPTS):
+            try:
+                text, info = await self.service.search(client, session.state.fen(), session.budget)
+            except Exception as e:
+                self.metrics.errors += 1
+                error = str(e) or type(e).__name__
+                continue
+            if text is not None:
+                session.task = None
+                self.apply(client, session, parse_uci_move(session.state, text), True, info)
+                return
+        session.task = None
+        session.over = True
+        session.record.finish('*', 'engine error')
+        client.send({'event': 'over', 'game': session.id, 'result': '*', 'reason': 'engine error', 'error': error})
+        self.end(client, session)
+
+    def end(self, client, session):
+        if session.task is not None:
+            session.task.cancel()
+            session.task = None
+        if client.games.pop(session.id, None) is None:
+            return
+        self.sessions -= 1
+        if not session.over:
+            session.record.finish('*', 'closed')
+        if self.log and len(session.record):
+            self.log.write_game(session.record)
+
+async def serve_metrics(server, reader, writer):
+    # A minimal HTTP endpoint: any request gets the metrics.
+    try:
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        body = prometheus(server.metrics.snapshot(server.service, server.sessions)).encode()
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                     b'Content-Length: %d\r\n\r\n' % len(body) + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def run_server(host, port, workers, tt_mb, book_path, log_path=None, metrics_port=None,
+                     report_interval=0):
+    service = EngineService(workers, tt_mb, book_path)
+    log = GameLogWriter(log_path) if log_path else None
+    server = GameServer(service, log)
+    servers = [await asyncio.start_server(server.handle, host, port, limit=1 << 16)]
+    print('serving games on %s:%d with %d engine workers' % (host, port, workers), file=sys.stderr)
+    if metrics_port:
+        servers.append(await asyncio.start_server(lambda r, w: serve_metrics(server, r, w), host, metrics_port))
+        print('metrics on http://%s:%d/' % (host, metrics_port), file=sys.stderr)
+    try:
+        while True:
+            await asyncio.sleep(report_interval or 3600)
+            if report_interval:
+                print(json.dumps(server.metrics.snapshot(service, server.sessions)), file=sys.stderr)
+    finally:
+        for s in servers:
+            s.close()
+        service.close()
+        if log:
+            log.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Host chess games against the engine over TCP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=2, help='engine processes (default 2)')
+    parser.add_argument('--hash', type=int, default=16, help='transposition table size per worker in MB')
+    parser.add_argument('--book', default=DEFAULT_BOOK_PATH, help="opening book, or '' for none")
+    parser.add_argument('--log', help='append finished games to this game log')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics over HTTP on this port')
+    parser.add_argument('--report', type=float, default=0, help='print metrics to stderr every N seconds')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_server(args.host, args.port, args.workers, args.hash, args.book or None, args.log,
+                               args.metrics_port, args.report))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import os
+from array import array
+
+from .board import popcount
+
+# Distance-to-mate tables for a lone king against a few pieces. Each table is
+# stored from the side with the extra pieces' point of view as white, one
+# byte per position: 0 is a draw (or an unreachable index), any other value v
+# means mate in v - 1 plies, won for the side to move when that is odd and
+# lost when it is even.
+TABLES = {'KQK': 'Q', 'KRK': 'R', 'KPK': 'P', 'KBNK': 'BN'}
+TABLE_ORDER = ['KQK', 'KRK', 'KPK', 'KBNK']
+MATERIAL_TABLES = {pieces: name for name, pieces in TABLES.items()}
+DRAWN_MATERIAL = ('', 'B', 'N')
+MAX_PIECES = 4
+DEFAULT_TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                     'tablebases')
+
+def _transform(flip_rows, flip_cols, swap):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        if swap:
+            r, c = c, r
+        if flip_rows:
+            r = 7 - r
+        if flip_cols:
+            c = 7 - c
+        table.append(r * 8 + c)
+    return table
+
+# Without pawns the board has eight symmetries, and every position can be
+# turned so the white king is in the a1-d1-d4 triangle. With pawns only the
+# left-right mirror is allowed, which puts the white king on files a-d. A king
+# on the a1-h8 diagonal leaves two choices; the one giving the smaller index
+# is used, so every position has exactly one index.
+TRANSFORMS = [_transform(fr, fc, sw) for sw in (False, True) for fr in (False, True) for fc in (False, True)]
+PAWNLESS_KING_SQUARES = [r * 8 + c for r in range(7, 3, -1) for c in range(4) if 7 - r <= c]
+PAWN_KING_SQUARES = [r * 8 + c for r in range(8) for c in range(4)]
+PAWNLESS_KING_TRANSFORMS = [[t for t in TRANSFORMS if t[sq] in PAWNLESS_KING_SQUARES] for sq in range(64)]
+PAWN_KING_TRANSFORMS = [[TRANSFORMS[0] if sq % 8 < 4 else TRANSFORMS[1]] for sq in range(64)]
+
+class Tablebase:
+    def __init__(self, name, values=None):
+        self.name = name
+        self.pieces = TABLES[name]
+        if 'P' in self.pieces:
+            self.king_squares, self.king_transforms = PAWN_KING_SQUARES, PAWN_KING_TRANSFORMS
+        else:
+            self.king_squares, self.king_transforms = PAWNLESS_KING_SQUARES, PAWNLESS_KING_TRANSFORMS
+        self.king_slots = {sq: i for i, sq in enumerate(self.king_squares)}
+        self.stride = 64 ** len(self.pieces)
+        self.size = 2 * len(self.king_squares) * 64 * self.stride
+        self.values = values if values is not None else array('B', bytes(self.size))
+
+    def index(self, white_to_move, wk, bk, others):
+        best = None
+        for t in self.king_transforms[wk]:
+            idx = ((not white_to_move) * len(self.king_squares) + self.king_slots[t[wk]]) * 64 + t[bk]
+            for sq in others:
+                idx = idx * 64 + t[sq]
+            if best is None or idx < best:
+                best = idx
+        return best
+
+    def position(self, idx):
+        others = []
+        for _ in self.pieces:
+            idx, sq = divmod(idx, 64)
+            others.append(sq)
+        others.reverse()
+        idx, bk = divmod(idx, 64)
+        black_to_move, slot = divmod(idx, len(self.king_squares))
+        return not black_to_move, self.king_squares[slot], bk, others
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            self.values.tofile(f)
+
+    @classmethod
+    def load(cls, name, path):
+        table = cls(name, array('B'))
+        with open(path, 'rb') as f:
+            table.values.fromfile(f, table.size)
+        return table
+
+_tables = {}
+
+def load_table(name, directory=DEFAULT_TABLEBASE_DIR):
+    key = (name, directory)
+    if key not in _tables:
+        try:
+            _tables[key] = Tablebase.load(name, os.path.join(directory, name + '.tb'))
+        except (OSError, EOFError):
+            _tables[key] = None
+    return _tables[key]
+
+def probe(state, directory=DEFAULT_TABLEBASE_DIR):
+    """Return (result, plies) for the side to move, where result is 1 for a
+    win, -1 for a loss and 0 for a draw, or None if no table covers state."""
+    pieces = state.pieces
+    if popcount(state.occupancy[0] | state.occupancy[1]) > MAX_PIECES or state.castling:
+        return None
+    white = ''.join(p * popcount(pieces[p]) for p in 'QRBNP')
+    black = ''.join(p.upper() * popcount(pieces[p]) for p in 'qrbnp')
+    if not black and white in DRAWN_MATERIAL or not white and black in DRAWN_MATERIAL:
+        return 0, 0
+    if not black and white in MATERIAL_TABLES:
+        strong, flip, white_to_move = white, 0, state.white_turn
+        wk, bk = pieces['K'], pieces['k']
+    elif not white and black in MATERIAL_TABLES:
+        strong, flip, white_to_move = black, 56, not state.white_turn
+        wk, bk = pieces['k'], pieces['K']
+    else:
+        return None
+    table = load_table(MATERIAL_TABLES[strong], directory)
+    if table is None:
+        return None
+    case = str.upper if not flip else str.lower
+    others = [(pieces[case(p)].bit_length() - 1) ^ flip for p in table.pieces]
+    v = table.values[table.index(white_to_move, (wk.bit_length() - 1) ^ flip,
+                                 (bk.bit_length() - 1) ^ flip, others)]
+    if not v:
+        return 0, 0
+    plies = v - 1
+    return (1 if plies % 2 else -1), plies
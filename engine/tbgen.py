@@ -0,0 +1,208 @@
+import argparse
+import os
+import sys
+import time
+
+from .board import KING_ATTACKS, KNIGHT_ATTACKS, GameState, bishop_attacks, is_attacked, rook_attacks
+from .tablebase import DEFAULT_TABLEBASE_DIR, TABLE_ORDER, TABLES, Tablebase, load_table
+
+# Retrograde generation: start from every checkmate, then walk backwards.
+# A white-to-move position is won as soon as one move reaches a lost
+# black-to-move position; a black-to-move position is lost once every king
+# move reaches a won one. Positions never reached are draws.
+
+class Generator:
+    def __init__(self, table, directory):
+        self.table = table
+        self.directory = directory
+        self.values = table.values
+        # Only the piece bitboards of the scratch board are used; place()
+        # fills them in.
+        self.scratch = GameState()
+        self.scratch.set_squares(['.'] * 64)
+
+    def place(self, wk, bk, others, skip=None):
+        pieces = self.scratch.pieces
+        for p in pieces:
+            pieces[p] = 0
+        pieces['K'] = 1 << wk
+        pieces['k'] = 1 << bk
+        white = 1 << wk
+        for p, sq in zip(self.table.pieces, others):
+            if sq != skip:
+                pieces[p] |= 1 << sq
+                white |= 1 << sq
+        self.scratch.occupancy = [1 << bk, white]
+        return white
+
+    def valid(self, white_to_move, wk, bk, others):
+        squares = [wk, bk] + others
+        if len(set(squares)) != len(squares) or KING_ATTACKS[wk] >> bk & 1:
+            return False
+        for p, sq in zip(self.table.pieces, others):
+            if p == 'P' and not 8 <= sq < 56:
+                return False
+        white = self.place(wk, bk, others)
+        if white_to_move:
+            return not is_attacked(self.scratch, bk, True, white | 1 << bk)
+        return True
+
+    def black_moves(self, wk, bk, others):
+        # Yields (target, capture) for every legal move of the lone king.
+        white = self.place(wk, bk, others)
+        occ = white | 1 << bk
+        targets = KING_ATTACKS[bk] & ~KING_ATTACKS[wk] & ~(1 << wk)
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            to = bit.bit_length() - 1
+            if bit & white:
+                self.place(wk, bk, others, skip=to)
+                attacked = is_attacked(self.scratch, to, True, occ ^ 1 << bk)
+                self.place(wk, bk, others)
+                if not attacked:
+                    yield to, True
+            elif not is_attacked(self.scratch, to, True, occ ^ 1 << bk):
+                yield to, False
+
+    def lost_after_all_moves(self, wk, bk, others):
+        # Value for black to move once every reply is a known white win, or 0.
+        worst = 0
+        for to, capture in self.black_moves(wk, bk, others):
+            if capture:
+                return 0
+            v = self.values[self.table.index(True, wk, to, others)]
+            if not v:
+                return 0
+            worst = max(worst, v)
+        return worst + 1 if worst else 0
+
+    def white_unmoves(self, wk, bk, others):
+        occ = 1 << wk | 1 << bk
+        for sq in others:
+            occ |= 1 << sq
+        empty = ~occ
+        sources = KING_ATTACKS[wk] & empty
+        while sources:
+            bit = sources & -sources
+            sources ^= bit
+            yield bit.bit_length() - 1, bk, others
+        for i, (p, sq) in enumerate(zip(self.table.pieces, others)):
+            if p == 'P':
+                back = []
+                if sq + 8 < 56 and not occ >> (sq + 8) & 1:
+                    back.append(sq + 8)
+                    if 32 <= sq < 40 and not occ >> (sq + 16) & 1:
+                        back.append(sq + 16)
+            else:
+                if p == 'N':
+                    sources = KNIGHT_ATTACKS[sq]
+                else:
+                    sources = 0
+                    if p in 'RQ':
+                        sources |= rook_attacks(sq, occ)
+                    if p in 'BQ':
+                        sources |= bishop_attacks(sq, occ)
+                sources &= empty
+                back = []
+                while sources:
+                    bit = sources & -sources
+                    sources ^= bit
+                    back.append(bit.bit_length() - 1)
+            for frm in back:
+                yield wk, bk, others[:i] + [frm] + others[i + 1:]
+
+    def promotion_seeds(self):
+        # White wins that leave this table by promoting into KQK.
+        queen_table = load_table('KQK', self.directory)
+        if queen_table is None:
+            raise RuntimeError('KQK must be generated before %s' % self.table.name)
+        seeds = {}
+        table = self.table
+        for idx in range(table.size // 2):
+            white_to_move, wk, bk, (pawn,) = table.position(idx)
+            if not 8 <= pawn < 16 or not self.valid(True, wk, bk, [pawn]):
+                continue
+            to = pawn - 8
+            if to in (wk, bk):
+                continue
+            v = queen_table.values[queen_table.index(False, wk, bk, [to])]
+            if v:
+                seeds.setdefault(v + 1, []).append(idx)
+        return seeds
+
+    def run(self):
+        table = self.table
+        values = self.values
+        frontier = []
+        for idx in range(table.size // 2, table.size):
+            white_to_move, wk, bk, others = table.position(idx)
+            if not self.valid(False, wk, bk, others) or table.index(False, wk, bk, others) != idx:
+                continue
+            self.place(wk, bk, others)
+            if is_attacked(self.scratch, bk, True) and next(self.black_moves(wk, bk, others), None) is None:
+                values[idx] = 1
+                frontier.append(idx)
+        seeds = self.promotion_seeds() if 'P' in table.pieces else {}
+
+        v = 1
+        while frontier or any(level > v for level in seeds):
+            following = []
+            for idx in seeds.pop(v + 1, ()):
+                if not values[idx]:
+                    values[idx] = v + 1
+                    following.append(idx)
+            for idx in frontier:
+                white_to_move, wk, bk, others = table.position(idx)
+                if not white_to_move:
+                    for pwk, pbk, pothers in self.white_unmoves(wk, bk, others):
+                        pidx = table.index(True, pwk, pbk, pothers)
+                        if not values[pidx] and self.valid(True, pwk, pbk, pothers):
+                            values[pidx] = v + 1
+                            following.append(pidx)
+                    continue
+                sources = KING_ATTACKS[bk] & ~KING_ATTACKS[wk]
+                while sources:
+                    bit = sources & -sources
+                    sources ^= bit
+                    frm = bit.bit_length() - 1
+                    if frm == wk or frm in others:
+                        continue
+                    pidx = table.index(False, wk, frm, others)
+                    if not values[pidx] and self.valid(False, wk, frm, others):
+                        lost = self.lost_after_all_moves(wk, frm, others)
+                        if lost:
+                            values[pidx] = lost
+                            following.append(pidx)
+            frontier = following
+            v += 1
+        return v - 1
+
+def generate(name, directory=DEFAULT_TABLEBASE_DIR):
+    table = Tablebase(name)
+    longest = Generator(table, directory).run()
+    os.makedirs(directory, exist_ok=True)
+    table.save(os.path.join(directory, name + '.tb'))
+    return table, longest
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate endgame distance-to-mate tables.')
+    parser.add_argument('tables', nargs='*', default=TABLE_ORDER,
+                        help='tables to build (default: %s)' % ' '.join(TABLE_ORDER))
+    parser.add_argument('-o', '--output', default=DEFAULT_TABLEBASE_DIR, help='directory for the table files')
+    args = parser.parse_args()
+
+    for name in args.tables:
+        if name not in TABLES:
+            parser.error('unknown table %s (choose from %s)' % (name, ', '.join(TABLE_ORDER)))
+    for name in sorted(args.tables, key=TABLE_ORDER.index):
+        start = time.perf_counter()
+        table, longest = generate(name, args.output)
+        wins = sum(1 for v in table.values[:table.size // 2] if v)
+        print('%-5s %9d positions, %8d white-to-move wins, longest mate %d plies, %.1fs' % (
+            name, table.size, wins, longest - 1, time.perf_counter() - start))
+        sys.stdout.flush()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
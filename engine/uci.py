@@ -0,0 +1,189 @@
+import sys
+import threading
+
+from .board import START_FEN, GameState, move_to_uci, parse_uci_move, variation_to_uci
+from .book import load_book
+from .search import (MATE_BOUND, MATE_SCORE, MAX_PLY, SearchContext, TranspositionTable, iterative_deepening,
+                     principal_variation)
+
+ENGINE_NAME = 'chess-with-ai'
+ENGINE_AUTHOR = 'Divyansh'
+DEFAULT_HASH_MB = 16
+DEFAULT_MOVES_TO_GO = 30
+
+GO_PARAMS = ('depth', 'movetime', 'nodes', 'wtime', 'btime', 'winc', 'binc', 'movestogo')
+
+def parse_go(tokens):
+    params = {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == 'infinite':
+            params['infinite'] = True
+        elif token in GO_PARAMS and i + 1 < len(tokens):
+            if not tokens[i + 1].lstrip('-').isdigit():
+                raise ValueError('invalid %s: %s' % (token, tokens[i + 1]))
+            params[token] = int(tokens[i + 1])
+            i += 1
+        i += 1
+    return params
+
+def allocate_time(params, white):
+    if 'movetime' in params:
+        return params['movetime'] / 1000
+    remaining = params.get('wtime' if white else 'btime')
+    if remaining is None or params.get('infinite'):
+        return None
+    increment = params.get('winc' if white else 'binc', 0)
+    moves_to_go = params.get('movestogo', DEFAULT_MOVES_TO_GO)
+    budget = remaining / moves_to_go + increment * 0.8
+    return max(0.01, min(budget, remaining * 0.5)) / 1000
+
+def format_score(score, white):
+    if not white:
+        score = -score
+    if abs(score) > MATE_BOUND:
+        plies = MATE_SCORE - abs(score)
+        moves = (plies + 1) // 2
+        return 'mate %d' % (moves if score > 0 else -moves)
+    return 'cp %d' % score
+
+class UCIEngine:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.lock = threading.Lock()
+        self.state = GameState()
+        self.hash_mb = DEFAULT_HASH_MB
+        self.ctx = None
+        self.stop_event = threading.Event()
+        self.search_thread = None
+        self.own_book = True
+        self.book = None
+
+    def send(self, line):
+        with self.lock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+    def context(self):
+        if self.ctx is None:
+            self.ctx = SearchContext(TranspositionTable(self.hash_mb))
+            self.ctx.stop_event = self.stop_event
+        return self.ctx
+
+    def wait(self):
+        if self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+
+        try:
+            if command == 'uci':
+                self.send('id name ' + ENGINE_NAME)
+                self.send('id author ' + ENGINE_AUTHOR)
+                self.send('option name Hash type spin default %d min 1 max 1024' % DEFAULT_HASH_MB)
+                self.send('option name OwnBook type check default true')
+                self.send('uciok')
+            elif command == 'isready':
+                self.context()
+                self.send('readyok')
+            elif command == 'ucinewgame':
+                self.wait()
+                self.ctx = None
+            elif command == 'setoption':
+                self.set_option(args)
+            elif command == 'position':
+                self.wait()
+                self.set_position(args)
+            elif command == 'go':
+                self.go(parse_go(args))
+            elif command == 'stop':
+                self.stop_event.set()
+                self.wait()
+            elif command == 'quit':
+                self.stop_event.set()
+                self.wait()
+                return False
+        except (ValueError, IndexError) as e:
+            # A malformed line is reported and ignored; the last valid
+            # position and options stay in effect.
+            self.send('info string %s' % (str(e) or 'invalid command: ' + line.strip()))
+        return True
+
+    def set_option(self, args):
+        if 'name' not in args or 'value' not in args:
+            return
+        name = ' '.join(args[args.index('name') + 1:args.index('value')])
+        value = ' '.join(args[args.index('value') + 1:])
+        if name.lower() == 'hash':
+            if not value.isdigit():
+                raise ValueError('invalid Hash value: ' + value)
+            self.wait()
+            self.hash_mb = max(1, min(1024, int(value)))
+            self.ctx = None
+        elif name.lower() == 'ownbook':
+            self.own_book = value.lower() == 'true'
+
+    def set_position(self, args):
+        if 'moves' in args:
+            split = args.index('moves')
+            setup, moves = args[:split], args[split + 1:]
+        else:
+            setup, moves = args, []
+        if setup and setup[0] == 'fen':
+            state = GameState.from_fen(' '.join(setup[1:]))
+        else:
+            state = GameState.from_fen(START_FEN)
+        for text in moves:
+            state.push(parse_uci_move(state, text))
+        self.state = state
+
+    def book_move(self, state):
+        if not self.own_book:
+            return None
+        if self.book is None:
+            self.book = load_book() or False
+        return self.book.choose(state) if self.book else None
+
+    def go(self, params):
+        self.wait()
+        state = self.state.copy()
+        move = None if params.get('infinite') else self.book_move(state)
+        if move:
+            self.send('bestmove ' + move_to_uci(move))
+            return
+        ctx = self.context()
+        self.stop_event.clear()
+        time_limit = allocate_time(params, state.white_turn)
+        max_depth = params.get('depth', MAX_PLY)
+        node_limit = params.get('nodes')
+
+        def report(depth, score, move, nodes, elapsed):
+            nps = int(nodes / elapsed) if elapsed else 0
+            self.send('info depth %d score %s nodes %d nps %d time %d pv %s' % (
+                depth, format_score(score, state.white_turn), nodes, nps, int(elapsed * 1000),
+                ' '.join(variation_to_uci(principal_variation(state, ctx.tt, move)))))
+
+        def run():
+            _, move = iterative_deepening(state, time_limit, max_depth, node_limit, ctx, report)
+            self.send('bestmove ' + (move_to_uci(move) if move else '0000'))
+
+        self.search_thread = threading.Thread(target=run, daemon=True)
+        self.search_thread.start()
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop_event.set()
+    engine.wait()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import time
+
+from engine import GameState, ParallelSearch, SearchContext, minimax, move_to_uci, INF
+
+POSITIONS = [
+    'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    '2r3k1/pp3ppp/2n1b3/3p4/3P4/2NB1N2/PP3PPP/2R3K1 b - - 0 1',
+]
+
+def run_sequential(fens, depth):
+    nodes = 0
+    start = time.perf_counter()
+    results = []
+    for fen in fens:
+        state = GameState.from_fen(fen)
+        ctx = SearchContext()
+        ctx.start(state)
+        score, move = minimax(state, depth, -INF, INF, state.white_turn, ctx)
+        nodes += ctx.nodes
+        results.append((score, move))
+    return results, nodes, time.perf_counter() - start
+
+def move_score(fen, move, depth):
+    # Serial full-window score of one root move.
+    state = GameState.from_fen(fen)
+    ctx = SearchContext()
+    ctx.start(state)
+    state.push(move)
+    return minimax(state, depth - 1, -INF, INF, state.white_turn, ctx)[0]
+
+def mismatches(fens, results, reference, depth):
+    # A result is wrong if its score differs from the serial search, or if
+    # it chose a different move that does not score the same.
+    count = 0
+    for fen, (score, move), (ref_score, ref_move) in zip(fens, results, reference):
+        if score != ref_score or move != ref_move and move_score(fen, move, depth) != ref_score:
+            count += 1
+    return count
+
+def run_parallel(fens, depth, workers):
+    nodes = 0
+    results = []
+    with ParallelSearch(workers) as searcher:
+        searcher.search(GameState(), 1)
+        start = time.perf_counter()
+        for fen in fens:
+            results.append(searcher.search(GameState.from_fen(fen), depth))
+            nodes += searcher.nodes
+        elapsed = time.perf_counter() - start
+    return results, nodes, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Speedup of the parallel root search versus worker count.')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--workers', default=None,
+                        help='comma separated worker counts (default: 1, 2, 4, ... up to the CPU count)')
+    args = parser.parse_args()
+
+    if args.workers:
+        counts = [int(w) for w in args.workers.split(',')]
+    else:
+        cpus = os.cpu_count() or 1
+        counts = []
+        w = 1
+        while w < cpus:
+            counts.append(w)
+            w *= 2
+        counts.append(cpus)
+
+    reference, nodes, base = run_sequential(POSITIONS, args.depth)
+    print('%-12s %8.2fs %10d nodes  speedup %5.2fx' % ('sequential', base, nodes, 1.0))
+    for workers in counts:
+        results, nodes, elapsed = run_parallel(POSITIONS, args.depth, workers)
+        wrong = mismatches(POSITIONS, results, reference, args.depth)
+        print('%-12s %8.2fs %10d nodes  speedup %5.2fx  %s' % (
+            '%d workers' % workers, elapsed, nodes, base / elapsed,
+            'results match' if not wrong else '%d mismatches' % wrong))
+    for fen, (score, move) in zip(POSITIONS, reference):
+        print('%s  %s %d' % (fen, move_to_uci(move), score))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import argparse
+import json
+import sys
+import time
+
+from engine import START_FEN, GameState, all_legal_moves, move_to_uci
+
+# Reference counts from the standard perft tables. The engine always
+# promotes to a queen, so entries marked "queen-only" subtract the
+# under-promotions from the published count; they are only used at depths
+# where promotions can happen on the last ply and nowhere earlier.
+POSITIONS = [
+    ('startpos', START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     {1: 48, 2: 2039, 3: 97862, 4: 4074224}),  # d4 queen-only (4085603 - 3/4 * 15172)
+    ('endgame-ep-pins', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ('promotion-checks', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     {1: 6, 2: 228}),  # d2 queen-only (264 - 3/4 * 48)
+    ('promotion-capture', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     {1: 41}),  # queen-only (44 - 3)
+    ('middlegame', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ('short-castle-check', '5k2/8/8/8/8/8/8/4K2R w K - 0 1', {6: 661072}),
+    ('long-castle-check', '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1', {6: 803711}),
+    ('castle-rights', 'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1', {4: 1274206}),
+    ('castle-prevented', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1', {4: 1720476}),
+    ('double-check', '8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1', {4: 23527}),
+]
+
+def perft(state, depth):
+    moves = all_legal_moves(state)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        state.push(move)
+        nodes += perft(state, depth - 1)
+        state.pop()
+    return nodes
+
+def divide(state, depth):
+    results = {}
+    for move in all_legal_moves(state):
+        state.push(move)
+        results[move_to_uci(move)] = perft(state, depth - 1) if depth > 1 else 1
+        state.pop()
+    return results
+
+def timed_perft(fen, depth):
+    state = GameState.from_fen(fen)
+    start = time.perf_counter()
+    nodes = perft(state, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+def run_suite(max_nodes, compare=None):
+    results = {}
+    failures = 0
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected in POSITIONS:
+        for depth, reference in sorted(expected.items()):
+            if reference > max_nodes:
+                continue
+            nodes, elapsed = timed_perft(fen, depth)
+            nps = nodes / elapsed if elapsed else 0.0
+            key = '%s/%d' % (name, depth)
+            results[key] = {'nodes': nodes, 'seconds': round(elapsed, 4), 'nps': round(nps)}
+            total_nodes += nodes
+            total_time += elapsed
+            ok = nodes == reference
+            failures += not ok
+            line = '%-26s %10d %10d %8.2fs %10.0f nps  %s' % (
+                key, nodes, reference, elapsed, nps, 'ok' if ok else 'MISMATCH')
+            if compare and key in compare and compare[key]['nps']:
+                change = (nps / compare[key]['nps'] - 1) * 100
+                line += '  %+.1f%%' % change
+            print(line)
+            sys.stdout.flush()
+    total_nps = total_nodes / total_time if total_time else 0.0
+    print('%d nodes in %.2fs, %.0f nps, %d mismatches' % (total_nodes, total_time, total_nps, failures))
+    results['total'] = {'nodes': total_nodes, 'seconds': round(total_time, 4), 'nps': round(total_nps)}
+    return results, failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Move generator perft counts and benchmark.')
+    parser.add_argument('depth', nargs='?', type=int, help='run a single perft to this depth')
+    parser.add_argument('--fen', default=START_FEN, help='position for a single perft run')
+    parser.add_argument('--divide', action='store_true', help='print node counts per root move')
+    parser.add_argument('--max-nodes', type=int, default=250000,
+                        help='skip suite entries whose reference count is larger than this')
+    parser.add_argument('--save', help='write suite timings to this JSON file')
+    parser.add_argument('--compare', help='compare nodes per second with a saved JSON file')
+    args = parser.parse_args()
+
+    if args.depth is not None:
+        state = GameState.from_fen(args.fen)
+        start = time.perf_counter()
+        if args.divide:
+            counts = divide(state, args.depth)
+            for move in sorted(counts):
+                print('%s: %d' % (move, counts[move]))
+            nodes = sum(counts.values())
+        else:
+            nodes = perft(state, args.depth)
+        elapsed = time.perf_counter() - start
+        print('nodes %d  time %.3fs  nps %.0f' % (nodes, elapsed, nodes / elapsed if elapsed else 0.0))
+        return 0
+
+    compare = None
+    if args.compare:
+        with open(args.compare) as f:
+            compare = json.load(f)
+    results, failures = run_suite(args.max_nodes, compare)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
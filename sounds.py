@@ -0,0 +1,106 @@
+import hashlib
+import math
+import os
+import time
+from array import array
+
+import pygame
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'sounds')
+SYNTH_VERSION = 1
+VOLUME = 0.3
+RAMP_MS = 5
+
+# Each sound is a sequence of (frequency in Hz, duration in ms) notes.
+TONES = {
+    'move': [(440, 50)],
+    'capture': [(330, 80)],
+    'castle': [(440, 40), (554, 60)],
+    'check': [(660, 60), (880, 90)],
+    'game_over': [(523, 120), (392, 120), (262, 240)],
+}
+
+def _synthesize_numpy(notes, rate, channels):
+    parts = []
+    for freq, ms in notes:
+        n = int(rate * ms / 1000)
+        i = numpy.arange(n)
+        ramp = min(n // 2, max(1, rate * RAMP_MS // 1000))
+        envelope = numpy.minimum(1.0, numpy.minimum(i, n - 1 - i) / ramp)
+        parts.append(numpy.sin(2 * math.pi * freq / rate * i) * envelope)
+    wave = (numpy.concatenate(parts) * (32767 * VOLUME)).astype(numpy.int16)
+    return numpy.repeat(wave, channels).tobytes()
+
+def _synthesize_array(notes, rate, channels):
+    samples = array('h')
+    for freq, ms in notes:
+        n = int(rate * ms / 1000)
+        ramp = min(n // 2, max(1, rate * RAMP_MS // 1000))
+        step = 2 * math.pi * freq / rate
+        amplitude = 32767 * VOLUME
+        wave = [amplitude * math.sin(step * i) for i in range(n)]
+        for i in range(ramp):
+            wave[i] *= i / ramp
+            wave[n - 1 - i] *= i / ramp
+        samples.extend(map(int, wave))
+    if channels == 1:
+        return samples.tobytes()
+    interleaved = array('h', bytes(2 * channels * len(samples)))
+    for channel in range(channels):
+        interleaved[channel::channels] = samples
+    return interleaved.tobytes()
+
+def synthesize(notes, rate, channels):
+    """Signed 16-bit PCM for the notes, with short fade-in and fade-out
+    ramps so the tones start and stop without clicks."""
+    if numpy is not None:
+        return _synthesize_numpy(notes, rate, channels)
+    return _synthesize_array(notes, rate, channels)
+
+class SoundBank:
+    def __init__(self, tones=TONES, cache_dir=CACHE_DIR):
+        self.sounds = {}
+        self.synthesized = 0
+        self.cached = 0
+        start = time.perf_counter()
+        mixer = pygame.mixer.get_init()
+        if mixer and mixer[1] == -16:
+            rate, _, channels = mixer
+            for name, notes in tones.items():
+                data = self.load(cache_dir, name, notes, rate, channels)
+                self.sounds[name] = pygame.mixer.Sound(buffer=data)
+        self.load_seconds = time.perf_counter() - start
+
+    def load(self, cache_dir, name, notes, rate, channels):
+        key = hashlib.sha1(repr((SYNTH_VERSION, VOLUME, RAMP_MS, notes)).encode()).hexdigest()[:12]
+        path = os.path.join(cache_dir, '%s-%d-%d-%s.pcm' % (name, rate, channels, key))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.cached += 1
+            return data
+        except OSError:
+            pass
+        data = synthesize(notes, rate, channels)
+        self.synthesized += 1
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        except OSError:
+            pass
+        return data
+
+    def play(self, name):
+        sound = self.sounds.get(name)
+        if sound is not None:
+            sound.play()
+
+    def report(self):
+        return 'sounds: %d in %.1f ms (%d synthesized, %d cached)' % (
+            len(self.sounds), self.load_seconds * 1000, self.synthesized, self.cached)